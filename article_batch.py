@@ -0,0 +1,54 @@
+"""Compact columnar container for articles passed between pipeline stages."""
+
+from typing import Iterable, Iterator
+
+# Columns produced by the PubMed parser, in insert order
+ARTICLE_FIELDS = (
+    "pmid", "title", "authors", "authors_full", "journal", "pub_date", "abstract",
+    "doi", "pub_types", "mesh_terms", "affiliation", "grants", "coi_statement",
+    "is_open_access", "pmc_id", "issn", "url",
+)
+
+
+class ArticleBatch:
+    """A batch of articles stored as one list per column instead of one dict per article.
+
+    Stages read whole columns (``batch["pmid"]``) or row tuples over just the
+    columns they need (``batch.rows(("pmid", "url"))``), and attach new columns
+    such as ``citation_count`` with ``add_column`` without copying any records.
+    """
+
+    __slots__ = ("_columns", "_length")
+
+    def __init__(self, fields: Iterable[str] = ARTICLE_FIELDS):
+        self._columns: dict[str, list] = {f: [] for f in fields}
+        self._length = 0
+
+    def append(self, **values) -> None:
+        """Add one article; every column of the batch must be given."""
+        if values.keys() != self._columns.keys():
+            missing = self._columns.keys() - values.keys()
+            extra = values.keys() - self._columns.keys()
+            raise ValueError(f"article fields do not match batch (missing={sorted(missing)}, extra={sorted(extra)})")
+        for name, column in self._columns.items():
+            column.append(values[name])
+        self._length += 1
+
+    def add_column(self, name: str, values: list) -> None:
+        """Attach (or replace) a column computed by a later stage."""
+        if len(values) != self._length:
+            raise ValueError(f"column '{name}' has {len(values)} values, batch has {self._length}")
+        self._columns[name] = values
+
+    def rows(self, fields: Iterable[str]) -> Iterator[tuple]:
+        """Iterate over row tuples of the given columns."""
+        return zip(*(self._columns[f] for f in fields))
+
+    def __getitem__(self, name: str) -> list:
+        return self._columns[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._columns
+
+    def __len__(self) -> int:
+        return self._length
@@ -1,6 +1,5 @@
 """Backfill ISSNs for existing articles that don't have one yet."""
 
-import os
 import ssl
 import urllib.parse
 import urllib.request
@@ -8,13 +7,13 @@ import xml.etree.ElementTree as ET
 from pathlib import Path
 
 import certifi
-import psycopg2
 from dotenv import load_dotenv
 
+import db
+
 load_dotenv(Path(__file__).parent / ".env")
 
 SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
-DATABASE_URL = os.environ["DATABASE_URL"]
 
 PUBMED_FETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
 
@@ -63,29 +62,30 @@ def fetch_issns(pmids: list[str]) -> dict[str, str]:
     return results
 
 
-def main():
-    conn = psycopg2.connect(DATABASE_URL)
+def backfill(conn):
+    """Fill in missing ISSNs from PubMed, 100 PMIDs per request."""
     cur = conn.cursor()
 
     # Find articles without ISSN
-    cur.execute(
-        "SELECT pmid FROM articles WHERE (issn IS NULL OR issn = '') AND pmid != ''"
-    )
-    pmids = [r[0] for r in cur.fetchall()]
+    missing = "(issn IS NULL OR issn = '') AND pmid != ''"
+    cur.execute(f"SELECT COUNT(*) FROM articles WHERE {missing}")
+    total = cur.fetchone()[0]
 
-    if not pmids:
+    if not total:
         print("All articles already have ISSNs.")
         cur.close()
-        conn.close()
         return
 
-    print(f"Found {len(pmids)} articles without ISSN. Fetching from PubMed...")
+    print(f"Found {total} articles without ISSN. Fetching from PubMed...")
 
-    # Process in batches of 100
+    # Stream PMIDs from the server in batches of 100
     total_updated = 0
-    for i in range(0, len(pmids), 100):
-        batch = pmids[i : i + 100]
-        print(f"  Batch {i // 100 + 1}: fetching {len(batch)} articles...")
+    batches = db.stream_chunks(
+        f"SELECT pmid FROM articles WHERE {missing} ORDER BY id", chunk_size=100
+    )
+    for n, rows in enumerate(batches, 1):
+        batch = [r[0] for r in rows]
+        print(f"  Batch {n}: fetching {len(batch)} articles...")
 
         try:
             issn_map = fetch_issns(batch)
@@ -98,11 +98,17 @@ def main():
             total_updated += len(issn_map)
             print(f"    Updated {len(issn_map)} ISSNs.")
         except Exception as e:
+            conn.rollback()
             print(f"    Error: {e}")
 
-    print(f"\nTotal: updated ISSN for {total_updated} of {len(pmids)} articles.")
+    print(f"\nTotal: updated ISSN for {total_updated} of {total} articles.")
     cur.close()
-    conn.close()
+
+
+def main():
+    with db.connection() as conn:
+        backfill(conn)
+    db.close_pool()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,285 @@
+"""Build the related-articles lookup table from TF-IDF vectors.
+
+Each article is a sparse TF-IDF vector over its title, abstract and MeSH terms
+(MeSH headings are weighted up, major topics most). Top-k neighbours by cosine
+similarity are computed with batched sparse matrix products and stored in
+related_articles, so the site can show related articles with one indexed read.
+
+By default only articles not yet indexed are processed: their neighbour lists
+are computed against the whole corpus, and existing lists are updated only
+where a new article displaces a current neighbour. Use --full to rebuild.
+
+Articles linked as duplicates (errata, repeated PMIDs, superseded preprints)
+are left out of the corpus, since they would top the list of their original.
+"""
+
+import argparse
+import re
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+import db
+
+load_dotenv(Path(__file__).parent / ".env")
+
+TOP_K = 10
+BATCH_SIZE = 256
+MIN_DF = 2
+TITLE_WEIGHT = 2.0
+MESH_WEIGHT = 2.0
+MAJOR_MESH_WEIGHT = 3.0
+
+TOKEN_RE = re.compile(r"[a-z][a-z0-9\-]{2,}")
+STOPWORDS = frozenset("""
+    the and for with was were are this that from have has had not but its their these those
+    which who whom than then there here into onto over under after before between during
+    our all any can may also such both each more most other some only same very been being
+    patients patient study studies results methods conclusion conclusions background objective
+    using used use based group groups case cases total mean years year versus vs
+""".split())
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens without stopwords."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def document_terms(title: str, abstract: str, mesh_terms: str) -> Counter:
+    """Weighted term counts for one article; MeSH headings become single terms."""
+    terms: Counter = Counter()
+    for t in tokenize(title or ""):
+        terms[t] += TITLE_WEIGHT
+    for t in tokenize(abstract or ""):
+        terms[t] += 1.0
+    for heading in (mesh_terms or "").split(", "):
+        if not heading:
+            continue
+        major = heading.startswith("*")
+        terms["mesh:" + heading.lstrip("*").lower()] += MAJOR_MESH_WEIGHT if major else MESH_WEIGHT
+    return terms
+
+
+def build_matrix(docs: list[Counter]) -> sp.csr_matrix:
+    """L2-normalized TF-IDF matrix (one row per document) with sublinear TF."""
+    vocab: dict[str, int] = {}
+    indptr = [0]
+    indices: list[int] = []
+    counts: list[float] = []
+    for terms in docs:
+        for term, count in terms.items():
+            indices.append(vocab.setdefault(term, len(vocab)))
+            counts.append(count)
+        indptr.append(len(indices))
+
+    indices_arr = np.asarray(indices, dtype=np.int32)
+    counts_arr = np.asarray(counts, dtype=np.float32)
+    indptr_arr = np.asarray(indptr, dtype=np.int64)
+
+    df = np.bincount(indices_arr, minlength=len(vocab)).astype(np.float32)
+    idf = np.log((1.0 + len(docs)) / (1.0 + df)) + 1.0
+    idf[df < MIN_DF] = 0.0  # terms seen once cannot link two articles
+
+    data = (1.0 + np.log(counts_arr)) * idf[indices_arr]
+    matrix = sp.csr_matrix((data, indices_arr, indptr_arr), shape=(len(docs), len(vocab)), dtype=np.float32)
+    matrix.eliminate_zeros()
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sp.diags(1.0 / norms).dot(matrix).tocsr().astype(np.float32)
+
+
+def top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Column indices and values of the k largest scores per row, best first."""
+    k = min(k, scores.shape[1])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    vals = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-vals, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(vals, order, axis=1)
+
+
+def ensure_tables(conn):
+    """Create the lookup table and the per-article indexed marker (one-time, via init_schema)."""
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS related_articles (
+            article_id INTEGER NOT NULL REFERENCES articles(id) ON DELETE CASCADE,
+            rank SMALLINT NOT NULL,
+            related_id INTEGER NOT NULL REFERENCES articles(id) ON DELETE CASCADE,
+            score REAL NOT NULL,
+            PRIMARY KEY (article_id, rank)
+        )
+    """)
+    cur.execute("ALTER TABLE articles ADD COLUMN IF NOT EXISTS related_indexed_at TIMESTAMPTZ")
+    conn.commit()
+    cur.close()
+
+
+def drop_duplicate_neighbours(conn) -> int:
+    """Remove stored lists of, and entries pointing at, articles since linked as duplicates.
+
+    Lists that lose an entry are marked unindexed so this run recomputes them.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE articles SET related_indexed_at = NULL
+        WHERE id IN (
+            SELECT r.article_id FROM related_articles r
+            JOIN articles d ON d.id = r.related_id
+            WHERE d.duplicate_of IS NOT NULL
+        )
+    """)
+    requeued = cur.rowcount
+    cur.execute("""
+        DELETE FROM related_articles r USING articles d
+        WHERE d.duplicate_of IS NOT NULL AND (r.article_id = d.id OR r.related_id = d.id)
+    """)
+    conn.commit()
+    cur.close()
+    return requeued
+
+
+def load_corpus() -> tuple[np.ndarray, np.ndarray, list[Counter]]:
+    """Stream (id, indexed flag, weighted terms) for every canonical article."""
+    ids, indexed, docs = [], [], []
+    for rows in db.stream_chunks(
+        "SELECT id, related_indexed_at IS NOT NULL, title, abstract, mesh_terms FROM articles "
+        "WHERE duplicate_of IS NULL ORDER BY id",
+        chunk_size=2000,
+    ):
+        for aid, done, title, abstract, mesh in rows:
+            ids.append(aid)
+            indexed.append(done)
+            docs.append(document_terms(title, abstract, mesh))
+    return np.asarray(ids, dtype=np.int64), np.asarray(indexed, dtype=bool), docs
+
+
+def load_neighbours(id_to_row: dict[int, int], n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Current stored neighbour lists as dense (n, TOP_K) row-index and score arrays."""
+    rows = np.full((n, TOP_K), -1, dtype=np.int64)
+    scores = np.zeros((n, TOP_K), dtype=np.float32)
+    for chunk in db.stream_chunks(
+        "SELECT article_id, rank, related_id, score FROM related_articles WHERE rank < %s",
+        (TOP_K,), chunk_size=5000,
+    ):
+        for aid, rank, rid, score in chunk:
+            if aid in id_to_row and rid in id_to_row:
+                rows[id_to_row[aid], rank] = id_to_row[rid]
+                scores[id_to_row[aid], rank] = score
+    return rows, scores
+
+
+def write_neighbours(conn, ids: np.ndarray, targets: np.ndarray, rows: np.ndarray, scores: np.ndarray):
+    """Replace the stored neighbour lists of the given target rows."""
+    if not len(targets):
+        return
+    records = []
+    for t in targets:
+        rank = 0
+        for r, s in zip(rows[t], scores[t]):
+            if r < 0 or s <= 0:
+                continue
+            records.append((int(ids[t]), rank, int(ids[r]), float(s)))
+            rank += 1
+    cur = conn.cursor()
+    cur.execute("DELETE FROM related_articles WHERE article_id = ANY(%s)", ([int(ids[t]) for t in targets],))
+    execute_values(
+        cur,
+        "INSERT INTO related_articles (article_id, rank, related_id, score) VALUES %s",
+        records,
+        page_size=1000,
+    )
+    conn.commit()
+    cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--full", action="store_true", help="recompute neighbours for every article")
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        requeued = drop_duplicate_neighbours(conn)
+    if requeued:
+        print(f"Dropped duplicates from {requeued} neighbour lists; recomputing them.")
+
+    ids, indexed, docs = load_corpus()
+    n = len(ids)
+    if args.full:
+        indexed[:] = False
+    new_rows = np.flatnonzero(~indexed)
+    print(f"Corpus: {n} articles, {len(new_rows)} to index.")
+    if n < 2 or not len(new_rows):
+        print("Nothing to do.")
+        db.close_pool()
+        return
+
+    matrix = build_matrix(docs)
+    del docs
+    print(f"TF-IDF matrix: {matrix.shape[0]} x {matrix.shape[1]}, {matrix.nnz} non-zeros.")
+
+    id_to_row = {int(aid): i for i, aid in enumerate(ids)}
+    if args.full:
+        nb_rows = np.full((n, TOP_K), -1, dtype=np.int64)
+        nb_scores = np.zeros((n, TOP_K), dtype=np.float32)
+    else:
+        nb_rows, nb_scores = load_neighbours(id_to_row, n)
+
+    is_new = np.zeros(n, dtype=bool)
+    is_new[new_rows] = True
+    # Score an existing list must beat to be displaced: its k-th entry, or 0 if not full
+    kth_score = np.where(nb_rows[:, -1] >= 0, nb_scores[:, -1], 0.0)
+    touched = np.zeros(n, dtype=bool)
+    matrix_t = matrix.T.tocsc()
+
+    for start in range(0, len(new_rows), BATCH_SIZE):
+        batch = new_rows[start : start + BATCH_SIZE]
+        scores = (matrix[batch] @ matrix_t).toarray()
+        scores[np.arange(len(batch)), batch] = -1.0  # never your own neighbour
+
+        # New articles: neighbours against the whole corpus
+        idx, vals = top_k(scores, TOP_K)
+        nb_rows[batch, : idx.shape[1]] = idx
+        nb_scores[batch, : vals.shape[1]] = vals
+        touched[batch] = True
+
+        # Existing articles: merge in any new article that beats their current k-th neighbour
+        if not args.full:
+            best = scores.max(axis=0)
+            candidates = np.flatnonzero((best > kth_score) & ~is_new)
+            if len(candidates):
+                merged_rows = np.concatenate([nb_rows[candidates], np.broadcast_to(batch, (len(candidates), len(batch)))], axis=1)
+                merged_scores = np.concatenate([nb_scores[candidates], scores[:, candidates].T], axis=1)
+                merged_scores[merged_rows < 0] = -1.0
+                sel, vals = top_k(merged_scores, TOP_K)
+                nb_rows[candidates] = np.take_along_axis(merged_rows, sel, axis=1)
+                nb_scores[candidates] = vals
+                kth_score[candidates] = np.maximum(vals[:, -1], 0.0)
+                touched[candidates] = True
+
+        print(f"  Scored {min(start + BATCH_SIZE, len(new_rows))}/{len(new_rows)} new articles.")
+
+    targets = np.flatnonzero(touched)
+    with db.connection() as conn:
+        for start in range(0, len(targets), 5000):
+            write_neighbours(conn, ids, targets[start : start + 5000], nb_rows, nb_scores)
+
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE articles SET related_indexed_at = NOW() WHERE id = ANY(%s)",
+            ([int(ids[r]) for r in new_rows],),
+        )
+        conn.commit()
+        cur.close()
+
+    db.close_pool()
+    print(f"Updated related articles for {len(targets)} articles "
+          f"({len(new_rows)} new, {len(targets) - len(new_rows)} existing lists changed).")
+
+
+if __name__ == "__main__":
+    main()
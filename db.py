@@ -0,0 +1,86 @@
+"""Shared PostgreSQL access: a connection pool and server-side streaming."""
+
+import os
+from contextlib import contextmanager
+from itertools import count
+from pathlib import Path
+from typing import Iterator
+
+from dotenv import load_dotenv
+from psycopg2.pool import ThreadedConnectionPool
+
+load_dotenv(Path(__file__).parent / ".env")
+
+DATABASE_URL = os.environ["DATABASE_URL"]
+POOL_MIN = 1
+POOL_MAX = int(os.environ.get("DB_POOL_MAX", "8"))
+STREAM_CHUNK_SIZE = 500
+
+_pool: ThreadedConnectionPool | None = None
+_cursor_ids = count(1)
+
+
+def get_pool() -> ThreadedConnectionPool:
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = ThreadedConnectionPool(POOL_MIN, POOL_MAX, DATABASE_URL)
+    return _pool
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection; roll back on error and return it afterwards."""
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # close_pool() inside the block has already closed every connection
+        if not pool.closed:
+            if not conn.closed:
+                conn.rollback()
+            pool.putconn(conn, close=bool(conn.closed))
+
+
+def close_pool():
+    """Close all pooled connections."""
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+
+def _stream(query: str, params, chunk_size: int) -> Iterator[tuple[list[str], list[tuple]]]:
+    """Run a query on a named server-side cursor and yield (columns, rows) chunks."""
+    with connection() as conn:
+        cur = conn.cursor(name=f"stream_{next(_cursor_ids)}")
+        try:
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [d[0] for d in cur.description], rows
+        finally:
+            cur.close()
+
+
+def stream_chunks(query: str, params=None, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[list[tuple]]:
+    """Stream query results from the server in chunks of tuples.
+
+    Uses its own pooled connection, so the caller is free to write and commit
+    on another connection while the stream is being consumed.
+    """
+    for _, rows in _stream(query, params, chunk_size):
+        yield rows
+
+
+def stream_rows(query: str, params=None, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[dict]:
+    """Stream query results as dicts keyed by the projected column names."""
+    for columns, rows in _stream(query, params, chunk_size):
+        for row in rows:
+            yield dict(zip(columns, row))
@@ -0,0 +1,334 @@
+"""Ingest-time detection of duplicate, erratum and preprint/published article records.
+
+Incoming articles are checked, before they are saved and enriched, against an
+in-memory index of the existing corpus:
+
+- normalized DOI equality,
+- normalized title equality for erratum/correction notices, and
+- MinHash/LSH similarity of normalized title + abstract shingles, which catches
+  preprint/published pairs and the same paper indexed under different PMIDs.
+
+Matches are saved with duplicate_of pointing at the canonical article, which
+keeps them out of the enrichment queue and the feed. Retraction and
+expression-of-concern notices are not duplicates: they stay visible and set
+retraction_status on the article they refer to. Signatures are stored with
+each article at insert time, so building the index never re-reads abstracts and
+only the incoming batch is hashed.
+"""
+
+import hashlib
+import re
+from collections import defaultdict
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+import db
+
+NUM_PERM = 128
+LSH_BANDS = 32  # 4 rows per band: pairs above ~0.45 Jaccard become candidates
+SIMILARITY_THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+MIN_SHINGLES = 5  # too little text to compare reliably
+
+_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, (1 << 31) - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, (1 << 31) - 1, size=NUM_PERM, dtype=np.uint64)
+
+DOI_PREFIX_RE = re.compile(r"^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)", re.IGNORECASE)
+_NOTICE_SUFFIX = r"(?: (?:to|for|on|regarding))?\s*:\s*"
+ERRATUM_PREFIX_RE = re.compile(r"^(?:erratum|correction|corrigendum)" + _NOTICE_SUFFIX, re.IGNORECASE)
+RETRACTION_PREFIX_RE = re.compile(
+    r"^(retraction(?: note| notice)?|expression of concern)" + _NOTICE_SUFFIX, re.IGNORECASE,
+)
+ERRATUM_PUB_TYPES = ("Published Erratum",)
+# Publication type of a notice -> retraction_status it sets on the original
+RETRACTION_PUB_TYPES = {
+    "Retraction of Publication": "retracted",
+    "Expression of Concern": "expression_of_concern",
+}
+NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_doi(doi: str) -> str:
+    """Canonical lowercase DOI without resolver prefixes."""
+    return DOI_PREFIX_RE.sub("", (doi or "").strip()).strip().rstrip(".").lower()
+
+
+def normalize_title(title: str) -> str:
+    """Lowercase alphanumeric title with erratum/correction/retraction prefixes removed."""
+    title = (title or "").strip()
+    title = RETRACTION_PREFIX_RE.sub("", ERRATUM_PREFIX_RE.sub("", title))
+    title = re.sub(r'^"(.*)"\.?$', r"\1", title)
+    return NON_WORD_RE.sub(" ", title.lower()).strip()
+
+
+def is_notice(title: str, pub_types: str) -> bool:
+    """True for erratum and correction notices, which duplicate the article they correct."""
+    return any(t in (pub_types or "") for t in ERRATUM_PUB_TYPES) or bool(ERRATUM_PREFIX_RE.match(title or ""))
+
+
+def retraction_status(title: str, pub_types: str) -> str | None:
+    """The retraction_status a retraction or expression-of-concern notice sets, else None."""
+    for pub_type, status in RETRACTION_PUB_TYPES.items():
+        if pub_type in (pub_types or ""):
+            return status
+    match = RETRACTION_PREFIX_RE.match(title or "")
+    if match:
+        return "retracted" if match.group(1).lower().startswith("retraction") else "expression_of_concern"
+    return None
+
+
+def minhash(title: str, abstract: str) -> np.ndarray | None:
+    """MinHash signature of word shingles over title + abstract, or None if too short."""
+    words = (normalize_title(title) + " " + NON_WORD_RE.sub(" ", (abstract or "").lower())).split()
+    shingles = {" ".join(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=len(shingles),
+    ) % _PRIME
+    # (a * x + b) mod p for every permutation and shingle at once, then min per permutation
+    return ((np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def signature_bytes(signature: np.ndarray | None) -> bytes:
+    """Storage form of a signature; empty for text too short to hash."""
+    return b"" if signature is None else signature.tobytes()
+
+
+def signature_from_bytes(data) -> np.ndarray | None:
+    return np.frombuffer(data, dtype=np.uint32) if data else None
+
+
+class DuplicateIndex:
+    """In-memory DOI, notice-title and MinHash/LSH index over canonical articles, keyed by URL."""
+
+    def __init__(self):
+        self.by_doi: dict[str, str] = {}
+        self.by_title: dict[str, str] = {}
+        self.preprints: set[str] = set()
+        self.signatures: dict[str, np.ndarray] = {}
+        self.bands: list[dict[bytes, list[str]]] = [defaultdict(list) for _ in range(LSH_BANDS)]
+        self.urls: set[str] = set()
+        # Canonical records that were later superseded (preprint -> published version)
+        self.redirects: dict[str, str] = {}
+
+    def add(self, url: str, doi: str, title: str, pub_types: str, signature: np.ndarray | None) -> None:
+        """Index an article as canonical."""
+        self.urls.add(url)
+        if normalize_doi(doi):
+            self.by_doi.setdefault(normalize_doi(doi), url)
+        if not is_notice(title, pub_types) and not retraction_status(title, pub_types):
+            self.by_title.setdefault(normalize_title(title), url)
+        if "Preprint" in (pub_types or ""):
+            self.preprints.add(url)
+        if signature is not None:
+            self.signatures[url] = signature
+            for band, key in zip(self.bands, self._band_keys(signature)):
+                band[key].append(url)
+
+    def supersede(self, old_url: str, new_url: str) -> None:
+        """Make new_url the canonical record for everything that matched old_url."""
+        self.redirects[old_url] = new_url
+
+    def resolve(self, url: str) -> str:
+        while url in self.redirects:
+            url = self.redirects[url]
+        return url
+
+    def find(self, doi: str, title: str, pub_types: str, signature: np.ndarray | None) -> tuple[str, str] | None:
+        """Return (canonical url, reason) for a duplicate, or None."""
+        key = normalize_doi(doi)
+        if key and key in self.by_doi:
+            return self.resolve(self.by_doi[key]), "doi"
+
+        if is_notice(title, pub_types):
+            match = self.by_title.get(normalize_title(title))
+            return (self.resolve(match), "notice") if match else None
+        if retraction_status(title, pub_types):
+            return None  # kept visible; see find_retractions
+
+        if signature is None:
+            return None
+        candidates = {url for band, k in zip(self.bands, self._band_keys(signature)) for url in band.get(k, ())}
+        best, best_sim = None, 0.0
+        for url in candidates:
+            sim = float(np.mean(self.signatures[url] == signature))
+            if sim > best_sim:
+                best, best_sim = url, sim
+        if best is not None and best_sim >= SIMILARITY_THRESHOLD:
+            reason = "preprint" if best in self.preprints or "Preprint" in (pub_types or "") else "similar"
+            return self.resolve(best), reason
+        return None
+
+    @staticmethod
+    def _band_keys(signature: np.ndarray) -> list[bytes]:
+        return [band.tobytes() for band in np.split(signature, LSH_BANDS)]
+
+
+def ensure_duplicate_columns(conn):
+    """Add duplicate link, reason, MinHash signature and retraction status columns (one-time, via init_schema)."""
+    cur = conn.cursor()
+    cur.execute(
+        "ALTER TABLE articles "
+        "ADD COLUMN IF NOT EXISTS duplicate_of INTEGER REFERENCES articles(id) ON DELETE SET NULL, "
+        "ADD COLUMN IF NOT EXISTS duplicate_reason TEXT, "
+        "ADD COLUMN IF NOT EXISTS minhash BYTEA, "
+        "ADD COLUMN IF NOT EXISTS retraction_status TEXT"
+    )
+    conn.commit()
+    cur.close()
+
+
+def backfill_signatures(conn) -> int:
+    """Compute and store signatures for articles saved before they were kept (or whose text changed)."""
+    cur = conn.cursor()
+    filled = 0
+    for rows in db.stream_chunks(
+        "SELECT id, title, abstract FROM articles WHERE minhash IS NULL", chunk_size=2000,
+    ):
+        execute_values(
+            cur,
+            "UPDATE articles AS a SET minhash = v.minhash FROM (VALUES %s) AS v(id, minhash) WHERE a.id = v.id",
+            [(aid, psycopg2.Binary(signature_bytes(minhash(title, abstract)))) for aid, title, abstract in rows],
+            page_size=1000,
+        )
+        conn.commit()
+        filled += len(rows)
+    cur.close()
+    return filled
+
+
+def load_index(conn) -> DuplicateIndex:
+    """Build the index from stored signatures; only canonical articles become match targets."""
+    backfill_signatures(conn)
+    index = DuplicateIndex()
+    for rows in db.stream_chunks(
+        "SELECT url, duplicate_of IS NOT NULL, doi, title, pub_types, minhash FROM articles",
+        chunk_size=5000,
+    ):
+        for url, is_duplicate, doi, title, pub_types, signature in rows:
+            if is_duplicate:
+                index.urls.add(url)
+            else:
+                index.add(url, doi, title, pub_types, signature_from_bytes(signature))
+    return index
+
+
+def find_duplicates(index: DuplicateIndex, articles) -> list[tuple[str, str, str]]:
+    """Check an incoming ArticleBatch against the index.
+
+    Returns (duplicate url, canonical url, reason) links. Articles that are not
+    duplicates are added to the index, so duplicates within the batch are found
+    too. A published version that matches an indexed preprint becomes the
+    canonical record and the preprint is linked to it. Each article's signature
+    is attached to the batch as the ``minhash`` column for saving.
+    """
+    links = []
+    signatures = []
+    fields = ("url", "doi", "title", "abstract", "pub_types")
+    for url, doi, title, abstract, pub_types in articles.rows(fields):
+        signature = minhash(title, abstract)
+        signatures.append(psycopg2.Binary(signature_bytes(signature)))
+        if url in index.urls:
+            continue  # already stored; the insert will skip it
+        match = index.find(doi, title, pub_types, signature)
+        if match is None:
+            index.add(url, doi, title, pub_types, signature)
+            continue
+        canonical, reason = match
+        if reason == "preprint" and canonical in index.preprints and "Preprint" not in (pub_types or ""):
+            links.append((canonical, url, reason))
+            index.add(url, doi, title, pub_types, signature)
+            index.supersede(canonical, url)
+        else:
+            links.append((url, canonical, reason))
+            index.urls.add(url)
+    articles.add_column("minhash", signatures)
+    return links
+
+
+def link_duplicates(conn, links: list[tuple[str, str, str]]) -> int:
+    """Point each duplicate at its canonical article (both must already be saved)."""
+    if not links:
+        return 0
+    cur = conn.cursor()
+    execute_values(
+        cur,
+        "UPDATE articles AS a SET duplicate_of = c.id, duplicate_reason = v.reason "
+        "FROM (VALUES %s) AS v(url, canonical_url, reason) "
+        "JOIN articles c ON c.url = v.canonical_url "
+        "WHERE a.url = v.url AND c.duplicate_of IS NULL",
+        links,
+    )
+    # A preprint that just became a duplicate hands its own duplicates to the new canonical
+    cur.execute(
+        "UPDATE articles AS a SET duplicate_of = p.duplicate_of "
+        "FROM articles p WHERE a.duplicate_of = p.id AND p.duplicate_of IS NOT NULL"
+    )
+    conn.commit()
+    cur.close()
+    return len(links)
+
+
+def find_retractions(index: DuplicateIndex, articles) -> list[tuple[str, str]]:
+    """Match incoming retraction/expression-of-concern notices to the articles they refer to.
+
+    Returns (original url, retraction_status) pairs. Run after find_duplicates
+    so originals arriving in the same batch are indexed.
+    """
+    flags = []
+    for url, title, pub_types in articles.rows(("url", "title", "pub_types")):
+        status = retraction_status(title, pub_types)
+        original = index.by_title.get(normalize_title(title)) if status else None
+        if original and original != url:
+            flags.append((index.resolve(original), status))
+    return flags
+
+
+def flag_retractions(conn, flags: list[tuple[str, str]]) -> int:
+    """Set retraction_status on the flagged originals; a retraction outranks a concern."""
+    if not flags:
+        return 0
+    cur = conn.cursor()
+    execute_values(
+        cur,
+        "UPDATE articles AS a SET retraction_status = v.status "
+        "FROM (VALUES %s) AS v(url, status) "
+        "WHERE a.url = v.url AND a.retraction_status IS DISTINCT FROM 'retracted'",
+        flags,
+    )
+    conn.commit()
+    cur.close()
+    return len(flags)
+
+
+def restore_retraction_notices(conn) -> int:
+    """One-time fix for notices linked as duplicates before retractions were flagged instead.
+
+    Unlinks them so they are visible again and flags the article each one refers to.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT n.id, n.title, n.pub_types, o.url FROM articles n "
+        "JOIN articles o ON o.id = n.duplicate_of WHERE n.duplicate_reason = 'notice'"
+    )
+    restored, flags = [], []
+    for notice_id, title, pub_types, original_url in cur.fetchall():
+        status = retraction_status(title, pub_types)
+        if status:
+            restored.append(notice_id)
+            flags.append((original_url, status))
+    if restored:
+        cur.execute(
+            "UPDATE articles SET duplicate_of = NULL, duplicate_reason = NULL WHERE id = ANY(%s)",
+            (restored,),
+        )
+        conn.commit()
+        flag_retractions(conn, flags)
+    cur.close()
+    return len(restored)
@@ -1,17 +1,31 @@
 """Enrich articles with AI-generated summaries using Claude API."""
 
-import os
+import argparse
 import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
+from typing import Iterator
 
-import psycopg2
 from dotenv import load_dotenv
 import anthropic
 
+import db
+from enrich_planner import (
+    RateLimiter, load_token_model, pending_prompt_chars, plan_run, record_usage,
+)
+from publish_snapshots import publish
+from rank_articles import update_rank_scores
+
 load_dotenv(Path(__file__).parent / ".env")
 
-DATABASE_URL = os.environ["DATABASE_URL"]
 MODEL = "claude-haiku-4-5-20251001"
+# USD per million tokens for MODEL
+INPUT_PRICE_PER_MTOK = 1.0
+OUTPUT_PRICE_PER_MTOK = 5.0
+ENRICH_WORKERS = int(os.environ.get("ENRICH_WORKERS", "4"))
 
 SYSTEM_PROMPT = """\
 You are analyzing a scientific article. You must ONLY use information that is explicitly stated \
@@ -26,7 +40,7 @@ CRITICAL RULES:
 - For each field, if you cannot determine the answer with 100% confidence from the text provided, \
 mark it as 'Unknown' or 'Not specified'
 
-Always respond with valid JSON and nothing else."""
+Always respond by calling the record_enrichment tool and nothing else."""
 
 USER_PROMPT_TEMPLATE = """\
 Analyze ONLY the title and abstract below. Do not use any outside knowledge.
@@ -57,52 +71,229 @@ If unclear, choose "Outcomes study" as default.
 explicitly states results that would change clinical practice. Default to "Background knowledge" \
 if uncertain.
 
-Respond ONLY with JSON in this exact format:
-{{"summary": "...", "importance": "...", "news_value": N, "subspecialty": "...", "article_type": "...", "clinical_relevance": "..."}}"""
+Record the result by calling the record_enrichment tool."""
+
+SUBSPECIALTIES = (
+    "Oncology", "Vascular", "Spine", "Functional", "Trauma", "Pediatric", "Skull base", "General",
+)
+ARTICLE_TYPES = (
+    "Clinical trial", "Case report", "Review", "Technical note", "Outcomes study", "Basic research",
+)
+CLINICAL_RELEVANCE_LEVELS = (
+    "Practice-changing", "Important update", "Background knowledge", "Research only",
+)
+
+ENRICHMENT_TOOL = {
+    "name": "record_enrichment",
+    "description": "Record the structured analysis of one article.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "summary": {"type": "string"},
+            "importance": {"type": "string"},
+            "news_value": {"type": "integer", "minimum": 1, "maximum": 10},
+            "subspecialty": {"type": "string", "enum": list(SUBSPECIALTIES)},
+            "article_type": {"type": "string", "enum": list(ARTICLE_TYPES)},
+            "clinical_relevance": {"type": "string", "enum": list(CLINICAL_RELEVANCE_LEVELS)},
+        },
+        "required": [
+            "summary", "importance", "news_value", "subspecialty", "article_type", "clinical_relevance",
+        ],
+    },
+}
+
+# Re-ask with the validation errors this many times before dead-lettering
+VALIDATION_RETRIES = 1
+# Dead-lettered articles are only retried with --retry-failed, up to this many attempts
+MAX_FAILURE_ATTEMPTS = 3
+# Pending articles are read in pages of this many, each in its own short transaction
+QUEUE_PAGE_SIZE = 100
+
 
+class EnrichmentError(Exception):
+    """Claude's response could not be turned into valid enrichment data."""
 
-def get_unenriched_articles(conn) -> list[dict]:
-    """Get articles that haven't been enriched yet."""
+
+ENRICHABLE_WHERE = "abstract != '' AND duplicate_of IS NULL"
+UNENRICHED_WHERE = f"summary = '' AND {ENRICHABLE_WHERE}"
+NOT_DEAD_LETTERED_WHERE = (
+    "NOT EXISTS (SELECT 1 FROM enrichment_failures f WHERE f.article_id = articles.id)"
+)
+RETRYABLE_WHERE = (
+    "NOT EXISTS (SELECT 1 FROM enrichment_failures f "
+    f"WHERE f.article_id = articles.id AND f.attempts >= {MAX_FAILURE_ATTEMPTS})"
+)
+
+# Clearing these puts an article back in the enrichment queue
+RESET_ENRICHMENT_SQL = (
+    "summary='', importance='', news_value=0, "
+    "subspecialty='', article_type='', clinical_relevance=''"
+)
+
+
+def ensure_failures_table(conn):
+    """Create the dead-letter table for articles whose enrichment failed (one-time, via init_schema)."""
     cur = conn.cursor()
-    cur.execute(
-        "SELECT id, title, journal, abstract FROM articles "
-        "WHERE summary = '' AND abstract != '' "
-        "ORDER BY id"
-    )
-    rows = cur.fetchall()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS enrichment_failures (
+            article_id INTEGER PRIMARY KEY REFERENCES articles(id) ON DELETE CASCADE,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            reason TEXT NOT NULL,
+            last_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """)
+    conn.commit()
     cur.close()
-    return [
-        {"id": r[0], "title": r[1], "journal": r[2], "abstract": r[3]}
-        for r in rows
-    ]
 
 
-def enrich_article(client: anthropic.Anthropic, article: dict) -> dict:
-    """Call Claude to generate enrichment data."""
-    message = client.messages.create(
+def pending_where(retry_failed: bool = False, reset: bool = False) -> str:
+    """WHERE clause selecting articles that should be sent for enrichment.
+
+    With reset, also selects enriched articles that --reset would put back in the queue.
+    """
+    failures = RETRYABLE_WHERE if retry_failed else NOT_DEAD_LETTERED_WHERE
+    return f"{ENRICHABLE_WHERE if reset else UNENRICHED_WHERE} AND {failures}"
+
+
+def get_unenriched_articles(retry_failed: bool = False) -> Iterator[dict]:
+    """Yield articles that haven't been enriched yet, in id order.
+
+    Pages are read by keyset (id > last id) in short transactions, so no cursor
+    or snapshot stays open for the hours a rate-limited run can take.
+    """
+    last_id = 0
+    while True:
+        with db.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT id, title, journal, abstract FROM articles "
+                f"WHERE {pending_where(retry_failed)} AND id > %s "
+                "ORDER BY id LIMIT %s",
+                (last_id, QUEUE_PAGE_SIZE),
+            )
+            columns = [d[0] for d in cur.description]
+            rows = cur.fetchall()
+            cur.close()
+        if not rows:
+            return
+        for row in rows:
+            yield dict(zip(columns, row))
+        last_id = rows[-1][0]
+
+
+def request_enrichment(
+    client: anthropic.Anthropic,
+    article: dict,
+    system: str = SYSTEM_PROMPT,
+    template: str = USER_PROMPT_TEMPLATE,
+    max_tokens: int = 512,
+    history: list[dict] | None = None,
+):
+    """Send one article to Claude, forcing a record_enrichment tool call."""
+    messages = [{
+        "role": "user",
+        "content": template.format(
+            title=article["title"],
+            journal=article["journal"],
+            abstract=article["abstract"],
+        ),
+    }]
+    return client.messages.create(
         model=MODEL,
-        max_tokens=512,
-        messages=[{
-            "role": "user",
-            "content": USER_PROMPT_TEMPLATE.format(
-                title=article["title"],
-                journal=article["journal"],
-                abstract=article["abstract"],
-            ),
-        }],
-        system=SYSTEM_PROMPT,
+        max_tokens=max_tokens,
+        messages=messages + (history or []),
+        system=system,
+        tools=[ENRICHMENT_TOOL],
+        tool_choice={"type": "tool", "name": ENRICHMENT_TOOL["name"]},
     )
 
-    raw = message.content[0].text.strip()
-    if raw.startswith("```"):
-        raw = raw.split("\n", 1)[1]
-        raw = raw.rsplit("```", 1)[0]
-        raw = raw.strip()
-    return json.loads(raw)
+
+def validate_enrichment(data: dict) -> list[str]:
+    """Check enrichment data against the tool schema; return a list of problems."""
+    errors = []
+    for field in ENRICHMENT_TOOL["input_schema"]["required"]:
+        if field not in data:
+            errors.append(f"missing field '{field}'")
+    for field in ("summary", "importance"):
+        if field in data and (not isinstance(data[field], str) or not data[field].strip()):
+            errors.append(f"'{field}' must be a non-empty string")
+    if "news_value" in data:
+        value = data["news_value"]
+        if isinstance(value, str) and value.strip().isdigit():
+            value = data["news_value"] = int(value)
+        if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= 10:
+            errors.append(f"'news_value' must be an integer from 1 to 10, got {data['news_value']!r}")
+    for field, allowed in (
+        ("subspecialty", SUBSPECIALTIES),
+        ("article_type", ARTICLE_TYPES),
+        ("clinical_relevance", CLINICAL_RELEVANCE_LEVELS),
+    ):
+        if field in data and data[field] not in allowed:
+            errors.append(f"'{field}' must be one of {list(allowed)}, got {data[field]!r}")
+    return errors
+
+
+def parse_enrichment(message) -> tuple[dict, object]:
+    """Extract the tool input from a response; return (data, tool_use block)."""
+    for block in message.content:
+        if block.type == "tool_use" and block.name == ENRICHMENT_TOOL["name"]:
+            return dict(block.input), block
+    raise EnrichmentError(f"no {ENRICHMENT_TOOL['name']} call in response (stop_reason={message.stop_reason})")
+
+
+def prompt_chars(article: dict, history: list[dict] | None = None) -> int:
+    """Length of the rendered prompt plus any re-ask history, the input to token estimation."""
+    chars = len(SYSTEM_PROMPT) + len(USER_PROMPT_TEMPLATE.format(
+        title=article["title"], journal=article["journal"], abstract=article["abstract"],
+    ))
+    for turn in history or []:
+        for block in turn["content"]:
+            if isinstance(block, dict):
+                chars += len(block.get("content", ""))
+            elif block.type == "tool_use":
+                chars += len(json.dumps(block.input))
+            elif block.type == "text":
+                chars += len(block.text)
+    return chars
+
+
+def enrich_article(
+    client: anthropic.Anthropic, article: dict, max_tokens: int = 512, send=request_enrichment,
+) -> dict:
+    """Call Claude to generate enrichment data, re-asking once on invalid output.
+
+    Every API call goes through send(client, article, max_tokens=..., history=...),
+    which lets the caller rate-limit and meter each call individually.
+    """
+    history: list[dict] = []
+    errors: list[str] = []
+    for attempt in range(VALIDATION_RETRIES + 1):
+        message = send(client, article, max_tokens=max_tokens, history=history)
+        if message.stop_reason == "max_tokens":
+            # The limit is sized from typical output; give outliers a retry with more room
+            errors = [f"response truncated at max_tokens={max_tokens}"]
+            max_tokens *= 2
+            history = []
+            continue
+        data, block = parse_enrichment(message)
+        errors = validate_enrichment(data)
+        if not errors:
+            return data
+        # Targeted retry: hand the invalid call back with the exact problems
+        history += [
+            {"role": "assistant", "content": message.content},
+            {"role": "user", "content": [{
+                "type": "tool_result",
+                "tool_use_id": block.id,
+                "is_error": True,
+                "content": "Invalid values: " + "; ".join(errors) + ". Call the tool again with corrected values.",
+            }]},
+        ]
+    raise EnrichmentError("; ".join(errors))
 
 
 def save_enrichment(conn, article_id: int, data: dict):
-    """Save enrichment data to the database."""
+    """Save enrichment data to the database and clear any dead-letter entry."""
     cur = conn.cursor()
     cur.execute(
         "UPDATE articles SET summary=%s, importance=%s, news_value=%s, "
@@ -117,43 +308,139 @@ def save_enrichment(conn, article_id: int, data: dict):
             article_id,
         ),
     )
+    cur.execute("DELETE FROM enrichment_failures WHERE article_id = %s", (article_id,))
     conn.commit()
     cur.close()
 
 
-def main():
-    client = anthropic.Anthropic()
-    conn = psycopg2.connect(DATABASE_URL)
-
-    # Reset all to force re-enrichment
+def record_failure(conn, article_id: int, reason: str):
+    """Dead-letter an article so it is skipped on later runs."""
     cur = conn.cursor()
     cur.execute(
-        "UPDATE articles SET summary='', importance='', news_value=0, "
-        "subspecialty='', article_type='', clinical_relevance=''"
+        "INSERT INTO enrichment_failures (article_id, reason) VALUES (%s, %s) "
+        "ON CONFLICT (article_id) DO UPDATE SET "
+        "attempts = enrichment_failures.attempts + 1, reason = EXCLUDED.reason, last_attempt_at = NOW()",
+        (article_id, reason[:1000]),
     )
     conn.commit()
     cur.close()
 
-    articles = get_unenriched_articles(conn)
-    print(f"Found {len(articles)} articles to enrich.")
 
-    if not articles:
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--reset", action="store_true",
+        help="clear all existing enrichments first to force re-enrichment of every article",
+    )
+    parser.add_argument(
+        "--retry-failed", action="store_true",
+        help=f"also retry dead-lettered articles with fewer than {MAX_FAILURE_ATTEMPTS} failed attempts",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=ENRICH_WORKERS,
+        help=f"concurrent requests (default {ENRICH_WORKERS}, env ENRICH_WORKERS)",
+    )
+    parser.add_argument(
+        "--plan-only", action="store_true",
+        help="print the token, time and cost forecast without calling the API",
+    )
+    args = parser.parse_args()
+    # The main thread borrows one pooled connection for each queue page
+    workers = max(1, min(args.workers, db.POOL_MAX - 1))
+
+    client = anthropic.Anthropic()
+
+    # Everything up to the plan is read-only, so --plan-only never changes the database
+    with db.connection() as conn:
+        model = load_token_model(conn)
+    base_chars = prompt_chars({"title": "", "journal": "", "abstract": ""})
+    chars = pending_prompt_chars(pending_where(args.retry_failed, reset=args.reset), base_chars)
+    total = len(chars)
+    print(f"Found {total} articles to enrich.")
+
+    if not total:
         print("Nothing to do.")
-        conn.close()
+    else:
+        calibration = f"calibrated on {model.samples} calls" if model.samples else "default estimates"
+        plan = plan_run(chars, model, workers, INPUT_PRICE_PER_MTOK, OUTPUT_PRICE_PER_MTOK)
+        print(f"{plan.describe()} [{calibration}]")
+
+    if args.plan_only:
+        db.close_pool()
         return
 
-    for i, article in enumerate(articles, 1):
-        print(f"[{i}/{len(articles)}] {article['title'][:70]}...")
+    if args.reset:
+        with db.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"UPDATE articles SET {RESET_ENRICHMENT_SQL}")
+            conn.commit()
+            cur.close()
+
+    limiter = RateLimiter()
+    print_lock = threading.Lock()
+
+    def process(i: int, article: dict) -> int:
+        """Enrich one article; return 1 if it was dead-lettered."""
+        calls = []
+
+        def send(client, article, max_tokens, history):
+            # Every call, including re-asks and truncation retries, takes its own budget
+            n_chars = prompt_chars(article, history)
+            limiter.acquire(model.input_tokens(n_chars), max_tokens)
+            start = time.monotonic()
+            message = request_enrichment(client, article, max_tokens=max_tokens, history=history)
+            limiter.refund_output(max_tokens - message.usage.output_tokens)
+            usage = {"input_tokens": message.usage.input_tokens, "output_tokens": message.usage.output_tokens}
+            calls.append((n_chars, usage, time.monotonic() - start))
+            return message
+
+        data = failure = None
         try:
-            data = enrich_article(client, article)
-            save_enrichment(conn, article["id"], data)
-            print(f"  -> {data['subspecialty']} | {data['article_type']} | {data['clinical_relevance']} | NV:{data['news_value']}")
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"  -> ERROR: {e}")
+            data = enrich_article(client, article, max_tokens=model.max_tokens, send=send)
+            result = f"{data['subspecialty']} | {data['article_type']} | {data['clinical_relevance']} | NV:{data['news_value']}"
+        except EnrichmentError as e:
+            failure = str(e)
+            result = f"ERROR (dead-lettered): {e}"
+        except anthropic.BadRequestError as e:
+            # Deterministic rejection: resending the same request would fail again
+            failure = f"API {e.status_code}: {e.message}"
+            result = f"API ERROR (dead-lettered): {e}"
         except anthropic.APIError as e:
-            print(f"  -> API ERROR: {e}")
+            # Transient (rate limit, overload, network): leave it in the queue
+            result = f"API ERROR: {e}"
+
+        with db.connection() as worker_conn:
+            if failure is not None:
+                record_failure(worker_conn, article["id"], failure)
+            elif data is not None:
+                save_enrichment(worker_conn, article["id"], data)
+            for n_chars, usage, latency in calls:
+                record_usage(worker_conn, article["id"], n_chars, usage, latency)
+        with print_lock:
+            print(f"[{i}/{total}] {article['title'][:70]}...\n  -> {result}")
+        return int(failure is not None)
+
+    # Keep a bounded number of articles in flight so the stream is never read ahead
+    failed = 0
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, article in enumerate(get_unenriched_articles(args.retry_failed), 1):
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                failed += sum(f.result() for f in done)
+            in_flight.add(pool.submit(process, i, article))
+        failed += sum(f.result() for f in wait(in_flight).done)
+
+    if failed:
+        print(f"\n{failed} articles dead-lettered; see enrichment_failures (rerun with --retry-failed).")
+
+    with db.connection() as conn:
+        # news_value feeds the composite rank
+        update_rank_scores(conn)
 
-    conn.close()
+    # Refresh the static feed so the site picks up the new enrichments
+    publish()
+    db.close_pool()
     print("\nDone!")
 
 
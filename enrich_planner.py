@@ -0,0 +1,240 @@
+"""Token estimation, run planning and rate limiting for enrichment.
+
+Input tokens are estimated per article from the length of the rendered prompt,
+calibrated against the message.usage history in enrichment_usage. The output
+token limit is sized from the observed output distribution instead of a fixed
+512. A plan packs pending requests into per-minute windows under the account's
+request/input/output rate limits to forecast run time and cost before anything
+is sent. RateLimiter then keeps the workers at that pace.
+"""
+
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+import db
+
+# Per-minute limits of the account tier for MODEL
+REQUESTS_PER_MINUTE = int(os.environ.get("ANTHROPIC_RPM", "50"))
+INPUT_TOKENS_PER_MINUTE = int(os.environ.get("ANTHROPIC_ITPM", "50000"))
+OUTPUT_TOKENS_PER_MINUTE = int(os.environ.get("ANTHROPIC_OTPM", "10000"))
+# Plan against this share of each limit to leave headroom for estimation error
+RATE_LIMIT_HEADROOM = 0.9
+
+# Used until there is enough usage history to calibrate
+DEFAULT_TOKENS_PER_CHAR = 0.28
+DEFAULT_OVERHEAD_TOKENS = 700  # tool definition and message framing
+DEFAULT_MAX_TOKENS = 512
+DEFAULT_LATENCY_SECONDS = 4.0
+MIN_HISTORY = 20
+HISTORY_WINDOW = 2000
+
+# Output limit = this percentile of observed output tokens plus a margin, within bounds
+OUTPUT_PERCENTILE = 99
+OUTPUT_MARGIN = 1.25
+MIN_MAX_TOKENS = 256
+MAX_MAX_TOKENS = 1024
+
+
+def ensure_usage_table(conn):
+    """Create the table recording token usage of every enrichment call (one-time, via init_schema)."""
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS enrichment_usage (
+            id SERIAL PRIMARY KEY,
+            article_id INTEGER REFERENCES articles(id) ON DELETE SET NULL,
+            prompt_chars INTEGER NOT NULL,
+            input_tokens INTEGER NOT NULL,
+            output_tokens INTEGER NOT NULL,
+            latency_seconds REAL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """)
+    conn.commit()
+    cur.close()
+
+
+def record_usage(conn, article_id: int, prompt_chars: int, usage: dict, latency: float):
+    """Store the usage of one enrichment call for future calibration."""
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO enrichment_usage (article_id, prompt_chars, input_tokens, output_tokens, latency_seconds) "
+        "VALUES (%s, %s, %s, %s, %s)",
+        (article_id, prompt_chars, usage["input_tokens"], usage["output_tokens"], latency),
+    )
+    conn.commit()
+    cur.close()
+
+
+@dataclass
+class TokenModel:
+    """Calibrated per-request token estimates."""
+
+    tokens_per_char: float = DEFAULT_TOKENS_PER_CHAR
+    overhead_tokens: float = DEFAULT_OVERHEAD_TOKENS
+    expected_output: float = DEFAULT_MAX_TOKENS * 0.6
+    max_tokens: int = DEFAULT_MAX_TOKENS
+    latency: float = DEFAULT_LATENCY_SECONDS
+    samples: int = 0
+
+    def input_tokens(self, prompt_chars: int) -> int:
+        return int(math.ceil(self.overhead_tokens + self.tokens_per_char * prompt_chars))
+
+
+def load_token_model(conn) -> TokenModel:
+    """Fit the token model to the most recent usage history."""
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT prompt_chars, input_tokens, output_tokens, latency_seconds FROM enrichment_usage "
+        "ORDER BY id DESC LIMIT %s",
+        (HISTORY_WINDOW,),
+    )
+    rows = cur.fetchall()
+    cur.close()
+    if len(rows) < MIN_HISTORY:
+        return TokenModel(samples=len(rows))
+
+    history = np.asarray([(c, i, o, l if l is not None else np.nan) for c, i, o, l in rows], dtype=np.float64)
+    chars, inputs, outputs, latencies = history.T
+
+    # input_tokens ~ overhead + tokens_per_char * prompt_chars
+    if np.ptp(chars) > 0:
+        slope, intercept = np.polyfit(chars, inputs, 1)
+    else:
+        slope, intercept = DEFAULT_TOKENS_PER_CHAR, float(np.mean(inputs - DEFAULT_TOKENS_PER_CHAR * chars))
+    max_tokens = int(math.ceil(np.percentile(outputs, OUTPUT_PERCENTILE) * OUTPUT_MARGIN))
+
+    return TokenModel(
+        tokens_per_char=max(float(slope), 0.0),
+        overhead_tokens=max(float(intercept), 0.0),
+        expected_output=float(np.mean(outputs)),
+        max_tokens=min(max(max_tokens, MIN_MAX_TOKENS), MAX_MAX_TOKENS),
+        latency=float(np.nanmedian(latencies)) if np.isfinite(latencies).any() else DEFAULT_LATENCY_SECONDS,
+        samples=len(rows),
+    )
+
+
+@dataclass
+class RunPlan:
+    """Forecast for enriching a set of pending articles."""
+
+    articles: int
+    input_tokens: int
+    output_tokens: int
+    max_tokens: int
+    minutes: float
+    cost: float
+    bottleneck: str
+
+    def describe(self) -> str:
+        return (
+            f"Plan: {self.articles} requests, ~{self.input_tokens:,} input + ~{self.output_tokens:,} output tokens "
+            f"(max_tokens={self.max_tokens}), ~${self.cost:.2f}, ~{self.minutes:.1f} min "
+            f"(limited by {self.bottleneck})"
+        )
+
+
+def plan_run(
+    prompt_chars: list[int], model: TokenModel, workers: int, input_price: float, output_price: float,
+) -> RunPlan:
+    """Pack requests into per-minute windows under the rate limits and forecast time and cost.
+
+    Prices are USD per million input and output tokens.
+
+    Output is budgeted at the expected (mean observed) output per request:
+    RateLimiter reserves max_tokens on admission but refunds whatever was not
+    generated, so sustained throughput follows actual output.
+    """
+    budgets = {
+        "requests/min": REQUESTS_PER_MINUTE * RATE_LIMIT_HEADROOM,
+        "input tokens/min": INPUT_TOKENS_PER_MINUTE * RATE_LIMIT_HEADROOM,
+        "output tokens/min": OUTPUT_TOKENS_PER_MINUTE * RATE_LIMIT_HEADROOM,
+    }
+    estimates = [model.input_tokens(c) for c in prompt_chars]
+
+    windows = 0
+    used = dict.fromkeys(budgets, 0.0)
+    binding = dict.fromkeys(budgets, 0)
+    for tokens in estimates:
+        need = {"requests/min": 1, "input tokens/min": tokens, "output tokens/min": model.expected_output}
+        full = [k for k in budgets if used[k] + need[k] > budgets[k]]
+        if windows == 0 or full:
+            for k in full:
+                binding[k] += 1
+            windows += 1
+            used = dict.fromkeys(budgets, 0.0)
+        for k in budgets:
+            used[k] += need[k]
+
+    # Concurrency bound: each worker completes one request per observed latency
+    concurrency_minutes = len(estimates) * model.latency / max(workers, 1) / 60
+    # Full windows take a minute each; the last one only as long as its largest share
+    rate_minutes = (windows - 1) + max(used[k] / budgets[k] for k in budgets) if estimates else 0.0
+    if concurrency_minutes >= rate_minutes:
+        minutes, bottleneck = concurrency_minutes, f"{workers} workers at ~{model.latency:.1f}s/request"
+    else:
+        minutes, bottleneck = rate_minutes, max(binding, key=binding.get)
+
+    input_total = sum(estimates)
+    output_total = int(len(estimates) * model.expected_output)
+    cost = (input_total * input_price + output_total * output_price) / 1e6
+    return RunPlan(len(estimates), input_total, output_total, model.max_tokens, minutes, cost, bottleneck)
+
+
+def pending_prompt_chars(where: str, base_chars: int) -> list[int]:
+    """Prompt length of every pending article, without transferring any text."""
+    chars = []
+    for rows in db.stream_chunks(
+        f"SELECT length(title) + length(journal) + length(abstract) FROM articles WHERE {where}",
+        chunk_size=10000,
+    ):
+        chars.extend(base_chars + (n or 0) for (n,) in rows)
+    return chars
+
+
+class RateLimiter:
+    """Thread-safe token buckets for requests, input tokens and output tokens per minute."""
+
+    def __init__(
+        self,
+        requests_per_minute: float = REQUESTS_PER_MINUTE * RATE_LIMIT_HEADROOM,
+        input_per_minute: float = INPUT_TOKENS_PER_MINUTE * RATE_LIMIT_HEADROOM,
+        output_per_minute: float = OUTPUT_TOKENS_PER_MINUTE * RATE_LIMIT_HEADROOM,
+    ):
+        self._capacity = [requests_per_minute, input_per_minute, output_per_minute]
+        self._rate = [c / 60.0 for c in self._capacity]
+        self._level = list(self._capacity)
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._level = [min(c, l + r * elapsed) for c, l, r in zip(self._capacity, self._level, self._rate)]
+
+    def acquire(self, input_tokens: int, output_tokens: int):
+        """Block until one request with this many tokens fits in the budget."""
+        # Oversized requests are clipped to capacity so they can still go through eventually
+        need = [min(n, c) for n, c in zip((1, input_tokens, output_tokens), self._capacity)]
+        with self._cond:
+            while True:
+                self._refill()
+                if all(l >= n for l, n in zip(self._level, need)):
+                    self._level = [l - n for l, n in zip(self._level, need)]
+                    return
+                wait = max((n - l) / r for l, n, r in zip(self._level, need, self._rate) if l < n)
+                self._cond.wait(timeout=wait)
+
+    def refund_output(self, tokens: int):
+        """Return output tokens that were reserved but not generated."""
+        if tokens <= 0:
+            return
+        with self._cond:
+            self._refill()
+            self._level[2] = min(self._capacity[2], self._level[2] + tokens)
+            self._cond.notify_all()
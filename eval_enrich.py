@@ -0,0 +1,271 @@
+"""Compare two enrichment prompt versions on a stratified sample without saving to the DB.
+
+Samples articles from the live schema stratified by (subspecialty, article_type),
+runs both prompt versions concurrently and reports per-field agreement, enum
+validity, latency and token cost. Responses are cached on disk by a hash of
+the full request, so re-running with an unchanged prompt costs nothing.
+
+A prompt version is a Python file defining SYSTEM_PROMPT and/or
+USER_PROMPT_TEMPLATE; anything it leaves out falls back to enrich_articles.py.
+
+    python eval_enrich.py --candidate prompts/v2.py
+    python eval_enrich.py --baseline prompts/v1.py --candidate prompts/v2.py --sample 500
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+import anthropic
+
+import db
+import enrich_articles
+from enrich_articles import (
+    ENRICHMENT_TOOL, INPUT_PRICE_PER_MTOK, MODEL, OUTPUT_PRICE_PER_MTOK, EnrichmentError, parse_enrichment,
+    request_enrichment, validate_enrichment,
+)
+
+load_dotenv(Path(__file__).parent / ".env")
+
+CACHE_DIR = Path(__file__).parent / ".eval_cache"
+MAX_TOKENS = 512
+ENUM_FIELDS = ("subspecialty", "article_type", "clinical_relevance")
+COMPARED_FIELDS = ENUM_FIELDS + ("news_value",)
+
+SAMPLE_SQL = """
+    SELECT id, title, journal, abstract, subspecialty, article_type, clinical_relevance, news_value
+    FROM (
+        SELECT id, title, journal, abstract, subspecialty, article_type, clinical_relevance, news_value,
+               row_number() OVER (PARTITION BY subspecialty, article_type ORDER BY md5(id::text || %(seed)s)) AS rn,
+               count(*) OVER (PARTITION BY subspecialty, article_type) AS stratum_size
+        FROM articles
+        WHERE abstract != '' AND duplicate_of IS NULL
+    ) s
+    WHERE rn <= GREATEST(%(min_per_stratum)s, ROUND(stratum_size * %(fraction)s))
+    ORDER BY subspecialty, article_type, rn
+"""
+
+
+def load_prompt_version(path: str | None) -> dict:
+    """Load SYSTEM_PROMPT / USER_PROMPT_TEMPLATE from a file, defaulting to the live prompts."""
+    version = {
+        "name": "current",
+        "system": enrich_articles.SYSTEM_PROMPT,
+        "template": enrich_articles.USER_PROMPT_TEMPLATE,
+    }
+    if path:
+        spec = importlib.util.spec_from_file_location(Path(path).stem, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        version["name"] = Path(path).stem
+        version["system"] = getattr(module, "SYSTEM_PROMPT", version["system"])
+        version["template"] = getattr(module, "USER_PROMPT_TEMPLATE", version["template"])
+    return version
+
+
+def sample_articles(conn, size: int, min_per_stratum: int, seed: str) -> list[dict]:
+    """Proportionally allocated stratified sample, deterministic for a given seed."""
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM articles WHERE abstract != '' AND duplicate_of IS NULL")
+    total = cur.fetchone()[0]
+    cur.close()
+    if not total:
+        return []
+    params = {"seed": seed, "min_per_stratum": min_per_stratum, "fraction": min(1.0, size / total)}
+    return list(db.stream_rows(SAMPLE_SQL, params))
+
+
+def cache_key(version: dict, article: dict) -> str:
+    """Hash of everything that determines the response."""
+    payload = json.dumps({
+        "model": MODEL,
+        "max_tokens": MAX_TOKENS,
+        "system": version["system"],
+        "user": version["template"].format(
+            title=article["title"], journal=article["journal"], abstract=article["abstract"],
+        ),
+        "tool": ENRICHMENT_TOOL,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def run_one(client: anthropic.Anthropic, version: dict, article: dict) -> dict:
+    """Get one enrichment result, from the cache or from the API."""
+    path = CACHE_DIR / f"{cache_key(version, article)}.json"
+    if path.exists():
+        result = json.loads(path.read_text())
+        result["cached"] = True
+        return result
+
+    start = time.monotonic()
+    try:
+        message = request_enrichment(
+            client, article, system=version["system"], template=version["template"], max_tokens=MAX_TOKENS,
+        )
+    except anthropic.APIError as e:
+        # Not cached: API failures say nothing about the prompt
+        return {"data": None, "error": f"API: {e}", "latency": None, "usage": None, "cached": False}
+    latency = time.monotonic() - start
+
+    try:
+        data, _ = parse_enrichment(message)
+        error = None
+    except EnrichmentError as e:
+        data, error = None, str(e)
+    result = {
+        "data": data,
+        "error": error,
+        "latency": latency,
+        "usage": {"input_tokens": message.usage.input_tokens, "output_tokens": message.usage.output_tokens},
+    }
+    # Write then rename, so an interrupted run never leaves a truncated entry behind
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(result))
+    os.replace(tmp, path)
+    result["cached"] = False
+    return result
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def version_report(results: list[dict]) -> dict:
+    """Validity, latency and cost figures for one prompt version."""
+    parsed = [r["data"] for r in results if r["data"] is not None]
+    invalid_by_field = {f: 0 for f in COMPARED_FIELDS}
+    fully_valid = 0
+    for data in parsed:
+        errors = validate_enrichment(dict(data))
+        fully_valid += not errors
+        for f in COMPARED_FIELDS:
+            invalid_by_field[f] += any(f"'{f}'" in e for e in errors)
+
+    latencies = [r["latency"] for r in results if r["latency"] is not None]
+    usage = [r["usage"] for r in results if r["usage"]]
+    fresh_usage = [r["usage"] for r in results if r["usage"] and not r["cached"]]
+    tokens_in = sum(u["input_tokens"] for u in usage)
+    tokens_out = sum(u["output_tokens"] for u in usage)
+
+    def cost(us):
+        return sum(u["input_tokens"] * INPUT_PRICE_PER_MTOK + u["output_tokens"] * OUTPUT_PRICE_PER_MTOK for u in us) / 1e6
+
+    return {
+        "n": len(results),
+        "errors": len(results) - len(parsed),
+        "valid": fully_valid,
+        "invalid_by_field": invalid_by_field,
+        "cached": sum(r["cached"] for r in results),
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95),
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "cost": cost(usage),
+        "cost_this_run": cost(fresh_usage),
+    }
+
+
+def agreement(pairs: list[tuple[dict, dict]]) -> dict[str, float]:
+    """Share of article pairs where both sides agree, per field."""
+    pairs = [(a, b) for a, b in pairs if a and b]
+    if not pairs:
+        return {}
+    result = {f: sum(str(a.get(f)) == str(b.get(f)) for a, b in pairs) / len(pairs) for f in COMPARED_FIELDS}
+
+    def within_one(a, b):
+        try:
+            return abs(int(a["news_value"]) - int(b["news_value"])) <= 1
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    result["news_value ±1"] = sum(within_one(a, b) for a, b in pairs) / len(pairs)
+    return result
+
+
+def print_report(versions: list[dict], reports: list[dict], agreements: dict[str, dict]) -> None:
+    print("\n" + "=" * 80)
+    width = max(len(v["name"]) for v in versions) + 2
+    for version, r in zip(versions, reports):
+        print(f"\n{version['name']:<{width}} {r['n']} articles ({r['cached']} cached), "
+              f"{r['errors']} unparseable, {r['valid']}/{r['n'] - r['errors']} fully valid")
+        print(f"{'':<{width}} invalid: " + ", ".join(f"{f}={n}" for f, n in r["invalid_by_field"].items()))
+        print(f"{'':<{width}} latency p50={r['latency_p50']:.2f}s p95={r['latency_p95']:.2f}s")
+        print(f"{'':<{width}} tokens in={r['tokens_in']} out={r['tokens_out']}, "
+              f"cost ${r['cost']:.4f} (${r['cost_this_run']:.4f} this run)")
+
+    for label, fields in agreements.items():
+        print(f"\nAgreement {label}:")
+        for f, share in fields.items():
+            print(f"  {f:<20} {share:6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", help="prompt file for version A (default: current prompts)")
+    parser.add_argument("--candidate", help="prompt file for version B (default: current prompts)")
+    parser.add_argument("--sample", type=int, default=300, help="approximate sample size")
+    parser.add_argument("--min-per-stratum", type=int, default=3, help="minimum articles per stratum")
+    parser.add_argument("--seed", default="eval", help="sampling seed; keep it fixed to reuse cached runs")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent API requests")
+    args = parser.parse_args()
+
+    versions = [load_prompt_version(args.baseline), load_prompt_version(args.candidate)]
+    if versions[0]["name"] == versions[1]["name"]:
+        versions[0]["name"] += " (A)"
+        versions[1]["name"] += " (B)"
+
+    with db.connection() as conn:
+        articles = sample_articles(conn, args.sample, args.min_per_stratum, args.seed)
+    db.close_pool()
+    strata = {(a["subspecialty"], a["article_type"]) for a in articles}
+    print(f"Sampled {len(articles)} articles across {len(strata)} (subspecialty, article_type) strata.")
+    if not articles:
+        return
+
+    CACHE_DIR.mkdir(exist_ok=True)
+    client = anthropic.Anthropic()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        # Identical requests (e.g. both versions using the same prompts) are sent once
+        futures = {}
+        keys = [[cache_key(v, a) for a in articles] for v in versions]
+        for v, version_keys in zip(versions, keys):
+            for a, key in zip(articles, version_keys):
+                if key not in futures:
+                    futures[key] = pool.submit(run_one, client, v, a)
+
+        results = []
+        seen = set()
+        for version, version_keys in zip(versions, keys):
+            version_results = []
+            for i, key in enumerate(version_keys, 1):
+                result = dict(futures[key].result())
+                if key in seen:
+                    result["cached"] = True  # reused from an identical request in this run
+                seen.add(key)
+                version_results.append(result)
+                if i % 50 == 0 or i == len(version_keys):
+                    print(f"  {version['name']}: {i}/{len(version_keys)}")
+            results.append(version_results)
+
+    stored = [{f: a[f] for f in COMPARED_FIELDS} if a["subspecialty"] else None for a in articles]
+    a_data = [r["data"] for r in results[0]]
+    b_data = [r["data"] for r in results[1]]
+    agreements = {
+        f"{versions[0]['name']} vs {versions[1]['name']}": agreement(list(zip(a_data, b_data))),
+        f"{versions[0]['name']} vs stored labels": agreement(list(zip(a_data, stored))),
+        f"{versions[1]['name']} vs stored labels": agreement(list(zip(b_data, stored))),
+    }
+    print_report(versions, [version_report(r) for r in results], agreements)
+
+
+if __name__ == "__main__":
+    main()
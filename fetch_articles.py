@@ -1,6 +1,7 @@
 """Fetch recent neurosurgery articles from PubMed."""
 
-import os
+import hashlib
+from collections import Counter
 import urllib.request
 import urllib.parse
 import json
@@ -10,17 +11,28 @@ from datetime import datetime, timedelta
 from pathlib import Path
 
 import certifi
-import psycopg2
 from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+import db
+from dedup import find_duplicates, find_retractions, flag_retractions, link_duplicates, load_index
+from article_batch import ARTICLE_FIELDS, ArticleBatch
+from rank_articles import update_rank_scores
 
 load_dotenv(Path(__file__).parent / ".env")
 
 SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
-DATABASE_URL = os.environ["DATABASE_URL"]
 
 PUBMED_SEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
 PUBMED_FETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
 
+# PubMed-derived fields that make up an article's content hash
+HASHED_FIELDS = (
+    "title", "authors", "authors_full", "journal", "pub_date", "abstract", "doi",
+    "pub_types", "mesh_terms", "affiliation", "grants", "coi_statement",
+    "is_open_access", "pmc_id", "issn",
+)
+
 
 def search_pubmed(query: str, days: int = 7, max_results: int = 20) -> list[str]:
     """Search PubMed and return a list of article IDs."""
@@ -44,10 +56,11 @@ def search_pubmed(query: str, days: int = 7, max_results: int = 20) -> list[str]
     return data.get("esearchresult", {}).get("idlist", [])
 
 
-def fetch_articles(article_ids: list[str]) -> list[dict]:
+def fetch_articles(article_ids: list[str]) -> ArticleBatch:
     """Fetch full article details from PubMed via efetch XML."""
+    articles = ArticleBatch()
     if not article_ids:
-        return []
+        return articles
 
     params = urllib.parse.urlencode({
         "db": "pubmed",
@@ -59,7 +72,6 @@ def fetch_articles(article_ids: list[str]) -> list[dict]:
     with urllib.request.urlopen(url, context=SSL_CONTEXT) as response:
         root = ET.parse(response).getroot()
 
-    articles = []
     for art in root.findall("PubmedArticle"):
         citation = art.find("MedlineCitation")
         article_el = citation.find("Article")
@@ -197,25 +209,25 @@ def fetch_articles(article_ids: list[str]) -> list[dict]:
                     parts.append(text)
             abstract = "\n\n".join(parts)
 
-        articles.append({
-            "pmid": pmid,
-            "title": title,
-            "authors": authors_short,
-            "authors_full": authors_full,
-            "journal": journal,
-            "pub_date": pub_date,
-            "abstract": abstract,
-            "doi": doi,
-            "pub_types": pub_types_str,
-            "mesh_terms": mesh_terms_str,
-            "affiliation": first_affiliation,
-            "grants": grants_str,
-            "coi_statement": coi_statement,
-            "is_open_access": is_open_access,
-            "pmc_id": pmc_id,
-            "issn": issn,
-            "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
-        })
+        articles.append(
+            pmid=pmid,
+            title=title,
+            authors=authors_short,
+            authors_full=authors_full,
+            journal=journal,
+            pub_date=pub_date,
+            abstract=abstract,
+            doi=doi,
+            pub_types=pub_types_str,
+            mesh_terms=mesh_terms_str,
+            affiliation=first_affiliation,
+            grants=grants_str,
+            coi_statement=coi_statement,
+            is_open_access=is_open_access,
+            pmc_id=pmc_id,
+            issn=issn,
+            url=f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
+        )
 
     return articles
 
@@ -248,29 +260,45 @@ def fetch_citation_counts(pmids: list[str]) -> dict[str, int]:
     return counts
 
 
-def save_articles(conn, articles: list[dict]) -> int:
-    """Insert articles into the database, skipping duplicates."""
+def content_hash(values: tuple) -> str:
+    """Hash an article's HASHED_FIELDS values to detect later revisions."""
+    payload = json.dumps(list(values), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def ensure_content_hash_column(conn):
+    """Add the content_hash column used for change detection (one-time, via init_schema)."""
     cur = conn.cursor()
-    new_count = 0
-    for a in articles:
-        cur.execute(
-            "INSERT INTO articles "
-            "(pmid, title, authors, authors_full, journal, pub_date, abstract, doi, pub_types, mesh_terms, affiliation, citation_count, grants, coi_statement, is_open_access, pmc_id, issn, url) "
-            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
-            "ON CONFLICT (url) DO NOTHING",
-            (
-                a["pmid"], a["title"], a["authors"], a["authors_full"], a["journal"],
-                a["pub_date"], a["abstract"], a["doi"], a["pub_types"],
-                a["mesh_terms"], a["affiliation"], a.get("citation_count", 0),
-                a.get("grants", ""), a.get("coi_statement", ""),
-                a.get("is_open_access", 0), a.get("pmc_id", ""),
-                a.get("issn", ""), a["url"],
-            ),
-        )
-        new_count += cur.rowcount
+    cur.execute("ALTER TABLE articles ADD COLUMN IF NOT EXISTS content_hash TEXT")
     conn.commit()
     cur.close()
-    return new_count
+
+
+INSERT_FIELDS = ARTICLE_FIELDS + ("citation_count", "content_hash", "minhash")
+
+
+def save_articles(conn, articles: ArticleBatch) -> int:
+    """Bulk-insert a batch of articles into the database, skipping duplicates."""
+    if not len(articles):
+        return 0
+    if "citation_count" not in articles:
+        articles.add_column("citation_count", [0] * len(articles))
+    articles.add_column("content_hash", [content_hash(v) for v in articles.rows(HASHED_FIELDS)])
+    if "minhash" not in articles:
+        # Left NULL; the next load_index() computes it
+        articles.add_column("minhash", [None] * len(articles))
+
+    cur = conn.cursor()
+    inserted = execute_values(
+        cur,
+        f"INSERT INTO articles ({', '.join(INSERT_FIELDS)}) VALUES %s "
+        "ON CONFLICT (url) DO NOTHING RETURNING id",
+        list(articles.rows(INSERT_FIELDS)),
+        fetch=True,
+    )
+    conn.commit()
+    cur.close()
+    return len(inserted)
 
 
 QUERY = '"Neurosurgery"[MeSH] OR "Neurosurgical Procedures"[MeSH]'
@@ -289,35 +317,47 @@ def main():
     articles = fetch_articles(article_ids)
 
     # Fetch citation counts from Europe PMC
-    pmids = [a["pmid"] for a in articles if a["pmid"]]
+    pmids = [p for p in articles["pmid"] if p]
     print(f"Fetching citation counts for {len(pmids)} articles...")
     citation_counts = fetch_citation_counts(pmids)
-    for a in articles:
-        a["citation_count"] = citation_counts.get(a["pmid"], 0)
-    cited = sum(1 for a in articles if a["citation_count"] > 0)
+    articles.add_column("citation_count", [citation_counts.get(p, 0) for p in articles["pmid"]])
+    cited = sum(1 for c in articles["citation_count"] if c > 0)
     print(f"Found citations for {cited} articles.")
 
-    conn = psycopg2.connect(DATABASE_URL)
-    new_count = save_articles(conn, articles)
-
-    # Sync cached IFs from journals table to new articles
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE articles SET impact_factor = (
-            SELECT j.impact_factor FROM journals j
-            WHERE j.journal_name = articles.journal AND j.impact_factor IS NOT NULL
-        )
-        WHERE impact_factor IS NULL
-          AND journal IN (SELECT journal_name FROM journals WHERE impact_factor IS NOT NULL)
-    """)
-    conn.commit()
-
-    cur.execute("SELECT COUNT(*) FROM articles")
-    total = cur.fetchone()[0]
-    cur.close()
-    conn.close()
+    with db.connection() as conn:
+        # Link near-duplicates, errata and preprint/published pairs before enrichment sees them
+        index = load_index(conn)
+        links = find_duplicates(index, articles)
+        retractions = find_retractions(index, articles)
+        new_count = save_articles(conn, articles)
+        link_duplicates(conn, links)
+        flag_retractions(conn, retractions)
+
+        # Sync cached IFs from journals table to new articles
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE articles SET impact_factor = (
+                SELECT j.impact_factor FROM journals j
+                WHERE j.journal_name = articles.journal AND j.impact_factor IS NOT NULL
+            )
+            WHERE impact_factor IS NULL
+              AND journal IN (SELECT journal_name FROM journals WHERE impact_factor IS NOT NULL)
+        """)
+        conn.commit()
+
+        update_rank_scores(conn)
+
+        cur.execute("SELECT COUNT(*) FROM articles")
+        total = cur.fetchone()[0]
+        cur.close()
+    db.close_pool()
 
     print(f"Saved {new_count} new articles ({len(articles) - new_count} duplicates skipped).")
+    if links:
+        reasons = Counter(reason for _, _, reason in links)
+        print(f"Linked {len(links)} near-duplicates ({', '.join(f'{n} {r}' for r, n in reasons.items())}).")
+    if retractions:
+        print(f"Flagged {len(retractions)} articles with retraction or expression-of-concern notices.")
     print(f"Total articles in database: {total}")
 
 
@@ -1,5 +1,11 @@
-"""Fetch journal Impact Factors from OpenAlex and denormalize to articles."""
+"""Fetch journal Impact Factors from OpenAlex and denormalize to articles.
 
+By default only journals without an IF are looked up. With --refresh, journals
+whose if_updated_at is older than the TTL are re-checked in bulk by their stored
+OpenAlex ID, and only IFs that actually changed are written and re-propagated.
+"""
+
+import argparse
 import json
 import os
 import ssl
@@ -9,15 +15,21 @@ import urllib.request
 from pathlib import Path
 
 import certifi
-import psycopg2
 from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+import db
+from rank_articles import update_rank_scores
 
 load_dotenv(Path(__file__).parent / ".env")
 
 SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
-DATABASE_URL = os.environ["DATABASE_URL"]
 
 OPENALEX_BASE = "https://api.openalex.org"
+# Re-check a journal's IF once it is older than this
+IF_TTL_DAYS = int(os.environ.get("IF_TTL_DAYS", "90"))
+# OpenAlex allows up to 50 OR-ed values per filter and 200 results per page
+REFRESH_BATCH_SIZE = 50
 
 
 def openalex_get(url: str) -> dict | None:
@@ -56,8 +68,85 @@ def extract_if(source: dict) -> float | None:
     return None
 
 
-def main():
-    conn = psycopg2.connect(DATABASE_URL)
+def lookup_by_openalex_ids(openalex_ids: list[str]) -> dict[str, dict]:
+    """Fetch summary stats for up to REFRESH_BATCH_SIZE sources in one request, keyed by ID."""
+    short_ids = [oid.rsplit("/", 1)[-1] for oid in openalex_ids]
+    params = urllib.parse.urlencode({
+        "filter": "openalex:" + "|".join(short_ids),
+        "select": "id,summary_stats",
+        "per-page": len(short_ids),
+    })
+    data = openalex_get(f"{OPENALEX_BASE}/sources?{params}")
+    if not data:
+        return {}
+    return {source["id"].rsplit("/", 1)[-1]: source for source in data.get("results", [])}
+
+
+def refresh_stale(conn, ttl_days: int) -> int:
+    """Re-check IFs older than ttl_days; write and re-propagate only the changed ones."""
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id, journal_name, openalex_id, impact_factor FROM journals "
+        "WHERE openalex_id != '' AND openalex_id IS NOT NULL "
+        "AND (if_updated_at IS NULL OR if_updated_at < NOW() - make_interval(days => %s)) "
+        "ORDER BY if_updated_at NULLS FIRST",
+        (ttl_days,),
+    )
+    journals = cur.fetchall()
+    print(f"Found {len(journals)} journals with IF older than {ttl_days} days.")
+
+    changed: list[tuple[int, float]] = []
+    checked: list[int] = []
+    for i in range(0, len(journals), REFRESH_BATCH_SIZE):
+        batch = journals[i : i + REFRESH_BATCH_SIZE]
+        sources = lookup_by_openalex_ids([oid for _, _, oid, _ in batch])
+        time.sleep(0.1)
+        for jid, name, oid, old_if in batch:
+            source = sources.get(oid.rsplit("/", 1)[-1])
+            if source is None:
+                print(f"  {name}: not returned by OpenAlex, keeping IF")
+                continue
+            checked.append(jid)
+            new_if = extract_if(source)
+            if new_if is None:
+                # A gap in OpenAlex stats is not evidence the IF went away
+                print(f"  {name}: no IF in OpenAlex response, keeping {old_if}")
+                continue
+            old_if = round(float(old_if), 2) if old_if is not None else None
+            if new_if != old_if:
+                changed.append((jid, new_if))
+                print(f"  {name}: IF {old_if} -> {new_if}")
+
+    if changed:
+        execute_values(
+            cur,
+            "UPDATE journals AS j SET impact_factor = v.impact_factor::numeric, if_updated_at = NOW() "
+            "FROM (VALUES %s) AS v(id, impact_factor) WHERE j.id = v.id",
+            changed,
+        )
+    # Unchanged journals only get their timestamp bumped
+    unchanged = sorted(set(checked) - {jid for jid, _ in changed})
+    if unchanged:
+        cur.execute("UPDATE journals SET if_updated_at = NOW() WHERE id = ANY(%s)", (unchanged,))
+    conn.commit()
+    print(f"Checked {len(checked)} journals: {len(changed)} changed, {len(unchanged)} unchanged.")
+
+    if changed:
+        cur.execute("""
+            UPDATE articles SET impact_factor = j.impact_factor
+            FROM journals j
+            WHERE j.journal_name = articles.journal AND j.id = ANY(%s)
+              AND articles.impact_factor IS DISTINCT FROM j.impact_factor
+        """, ([jid for jid, _ in changed],))
+        print(f"Re-propagated IF to {cur.rowcount} articles.")
+        conn.commit()
+
+    cur.close()
+    return len(changed)
+
+
+def fill_missing(conn):
+    """Look up IFs for journals that have none yet and denormalize all IFs to articles."""
     cur = conn.cursor()
 
     # Step 1: Upsert unique (journal, issn) pairs from articles into journals table
@@ -132,7 +221,32 @@ def main():
     print(f"Denormalized IF to {affected} articles.")
 
     cur.close()
-    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--refresh", action="store_true",
+        help="re-check journals whose IF is older than the TTL instead of filling missing IFs",
+    )
+    parser.add_argument(
+        "--ttl-days", type=int, default=IF_TTL_DAYS,
+        help=f"age after which an IF is re-checked (default {IF_TTL_DAYS}, env IF_TTL_DAYS)",
+    )
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        if args.refresh:
+            changed = refresh_stale(conn, args.ttl_days)
+        else:
+            fill_missing(conn)
+            changed = True
+
+        if changed:
+            reranked = update_rank_scores(conn)
+            print(f"Updated rank_score for {reranked} articles.")
+
+    db.close_pool()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+"""Apply the schema additions the pipeline scripts rely on, and their one-time data fixes.
+
+Run once after deploying a change that adds a column, index or table. The
+scheduled scripts (fetch, enrich, revise, impact factors, related articles)
+only read and write rows, so they never take DDL locks on articles while the
+site is reading it. Every step is idempotent.
+"""
+
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import db
+from build_related import ensure_tables as ensure_related_tables
+from dedup import ensure_duplicate_columns, restore_retraction_notices
+from enrich_articles import ensure_failures_table
+from enrich_planner import ensure_usage_table
+from fetch_articles import ensure_content_hash_column
+from rank_articles import ensure_rank_column
+
+load_dotenv(Path(__file__).parent / ".env")
+
+SCHEMA_STEPS = (
+    ensure_content_hash_column,
+    ensure_duplicate_columns,
+    restore_retraction_notices,
+    ensure_rank_column,
+    ensure_failures_table,
+    ensure_usage_table,
+    ensure_related_tables,
+)
+
+
+def main():
+    with db.connection() as conn:
+        for step in SCHEMA_STEPS:
+            print(f"  {step.__name__}")
+            step(conn)
+    db.close_pool()
+    print("Schema is up to date.")
+
+
+if __name__ == "__main__":
+    main()
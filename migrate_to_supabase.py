@@ -1,83 +1,142 @@
-"""One-time migration: copy data from local SQLite to Supabase PostgreSQL."""
+"""One-time migration: copy data from local SQLite to Supabase PostgreSQL.
 
-import os
+Rows are streamed from SQLite in chunks, loaded into Postgres with COPY and
+committed per chunk together with a resume key, so an interrupted run picks
+up where it stopped. Tables are migrated in parallel.
+"""
+
+import io
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import psycopg2
 from dotenv import load_dotenv
 
+import db
+
 load_dotenv(Path(__file__).parent / ".env")
 
 DB_PATH = Path(__file__).parent / "articles.db"
-DATABASE_URL = os.environ["DATABASE_URL"]
-
-
-def migrate_articles(sqlite_conn, pg_conn):
-    """Migrate all articles from SQLite to PostgreSQL."""
-    cursor = sqlite_conn.execute("SELECT * FROM articles")
-    columns = [desc[0] for desc in cursor.description]
-    rows = cursor.fetchall()
-
-    if not rows:
-        print("No articles to migrate.")
-        return
-
-    # Build INSERT statement, excluding 'id' (let Postgres assign SERIAL)
-    cols_no_id = [c for c in columns if c != "id"]
-    placeholders = ", ".join(["%s"] * len(cols_no_id))
-    col_names = ", ".join(cols_no_id)
-    insert_sql = (
-        f"INSERT INTO articles ({col_names}) VALUES ({placeholders}) "
-        f"ON CONFLICT (url) DO NOTHING"
-    )
 
-    id_idx = columns.index("id")
-    pg_cur = pg_conn.cursor()
-    inserted = 0
-    for row in rows:
-        values = [row[columns.index(c)] for c in cols_no_id]
-        pg_cur.execute(insert_sql, values)
-        inserted += pg_cur.rowcount
+CHUNK_SIZE = 5000
+
+# table name -> conflict target in Postgres
+TABLES = {
+    "articles": "url",
+    "journals": "journal_name",
+}
+
+
+def ensure_progress_table(pg_conn):
+    """Create the table that stores the resume key per migrated table."""
+    cur = pg_conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS migration_progress (
+            table_name TEXT PRIMARY KEY,
+            last_rowid BIGINT NOT NULL,
+            migrated INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """)
     pg_conn.commit()
-    pg_cur.close()
-
-    print(f"Articles: {inserted} inserted out of {len(rows)} total ({len(rows) - inserted} skipped as duplicates).")
-
-
-def migrate_journals(sqlite_conn, pg_conn):
-    """Migrate all journals from SQLite to PostgreSQL."""
-    try:
-        cursor = sqlite_conn.execute("SELECT * FROM journals")
-    except sqlite3.OperationalError:
-        print("No journals table in SQLite. Skipping.")
-        return
-
-    columns = [desc[0] for desc in cursor.description]
-    rows = cursor.fetchall()
-
-    if not rows:
-        print("No journals to migrate.")
-        return
-
-    cols_no_id = [c for c in columns if c != "id"]
-    placeholders = ", ".join(["%s"] * len(cols_no_id))
-    col_names = ", ".join(cols_no_id)
-    insert_sql = (
-        f"INSERT INTO journals ({col_names}) VALUES ({placeholders}) "
-        f"ON CONFLICT (journal_name) DO NOTHING"
+    cur.close()
+
+
+def copy_value(value) -> str:
+    """Format a single value for COPY ... FROM STDIN in text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="replace")
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
     )
 
-    pg_cur = pg_conn.cursor()
-    inserted = 0
-    for row in rows:
-        values = [row[columns.index(c)] for c in cols_no_id]
-        pg_cur.execute(insert_sql, values)
-        inserted += pg_cur.rowcount
-    pg_conn.commit()
-    pg_cur.close()
 
-    print(f"Journals: {inserted} inserted out of {len(rows)} total.")
+def migrate_table(table: str, conflict_col: str) -> None:
+    """Stream one table from SQLite into PostgreSQL, resuming if interrupted."""
+    # Each worker uses its own connections; neither driver shares them across threads
+    sqlite_conn = sqlite3.connect(DB_PATH)
+    try:
+        with db.connection() as pg_conn:
+            try:
+                cursor = sqlite_conn.execute(f"SELECT * FROM {table} LIMIT 0")
+            except sqlite3.OperationalError:
+                print(f"No {table} table in SQLite. Skipping.")
+                return
+
+            # Column mapping is computed once: drop 'id' (let Postgres assign SERIAL)
+            columns = [desc[0] for desc in cursor.description]
+            cols_no_id = [c for c in columns if c != "id"]
+            col_names = ", ".join(cols_no_id)
+            total = sqlite_conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+            pg_cur = pg_conn.cursor()
+            pg_cur.execute(
+                "SELECT last_rowid, migrated FROM migration_progress WHERE table_name = %s",
+                (table,),
+            )
+            progress = pg_cur.fetchone()
+            last_rowid, migrated = progress if progress else (0, 0)
+            if progress:
+                print(f"{table}: resuming after rowid {last_rowid} ({migrated} already migrated).")
+
+            # Staging table is emptied on every commit, i.e. once per chunk
+            staging = f"_migrate_{table}"
+            pg_cur.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DELETE ROWS AS "
+                f"SELECT {col_names} FROM {table} WITH NO DATA"
+            )
+            pg_conn.commit()
+
+            cursor = sqlite_conn.execute(
+                f"SELECT rowid, {col_names} FROM {table} WHERE rowid > ? ORDER BY rowid",
+                (last_rowid,),
+            )
+            inserted = 0
+            seen = 0
+            while True:
+                rows = cursor.fetchmany(CHUNK_SIZE)
+                if not rows:
+                    break
+
+                buf = io.StringIO()
+                for row in rows:
+                    buf.write("\t".join(copy_value(v) for v in row[1:]))
+                    buf.write("\n")
+                buf.seek(0)
+
+                pg_cur.copy_expert(f"COPY {staging} ({col_names}) FROM STDIN", buf)
+                pg_cur.execute(
+                    f"INSERT INTO {table} ({col_names}) SELECT {col_names} FROM {staging} "
+                    f"ON CONFLICT ({conflict_col}) DO NOTHING"
+                )
+                inserted += pg_cur.rowcount
+                seen += len(rows)
+                last_rowid = rows[-1][0]
+                pg_cur.execute(
+                    "INSERT INTO migration_progress (table_name, last_rowid, migrated) "
+                    "VALUES (%s, %s, %s) "
+                    "ON CONFLICT (table_name) DO UPDATE SET "
+                    "last_rowid = EXCLUDED.last_rowid, migrated = EXCLUDED.migrated, updated_at = NOW()",
+                    (table, last_rowid, migrated + seen),
+                )
+                pg_conn.commit()
+                print(f"  {table}: {migrated + seen}/{total} rows processed.")
+
+            pg_cur.close()
+
+            if not seen and not migrated:
+                print(f"No {table} to migrate.")
+                return
+            print(f"{table.capitalize()}: {inserted} inserted out of {seen} streamed "
+                  f"({seen - inserted} skipped as duplicates).")
+    finally:
+        sqlite_conn.close()
 
 
 def verify(sqlite_conn, pg_conn):
@@ -110,18 +169,22 @@ def main():
         print(f"SQLite database not found at {DB_PATH}")
         return
 
-    print(f"Connecting to SQLite: {DB_PATH}")
-    sqlite_conn = sqlite3.connect(DB_PATH)
-
     print(f"Connecting to PostgreSQL...")
-    pg_conn = psycopg2.connect(DATABASE_URL)
+    with db.connection() as pg_conn:
+        ensure_progress_table(pg_conn)
+
+    print(f"Migrating {', '.join(TABLES)} from SQLite: {DB_PATH}")
+    with ThreadPoolExecutor(max_workers=len(TABLES)) as pool:
+        futures = [pool.submit(migrate_table, t, c) for t, c in TABLES.items()]
+        for future in futures:
+            future.result()
 
-    migrate_articles(sqlite_conn, pg_conn)
-    migrate_journals(sqlite_conn, pg_conn)
-    verify(sqlite_conn, pg_conn)
+    sqlite_conn = sqlite3.connect(DB_PATH)
+    with db.connection() as pg_conn:
+        verify(sqlite_conn, pg_conn)
 
     sqlite_conn.close()
-    pg_conn.close()
+    db.close_pool()
     print("\nMigration complete!")
 
 
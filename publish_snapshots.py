@@ -0,0 +1,146 @@
+"""Publish precomputed, paginated feed snapshots for the web front end.
+
+Writes one set of JSON pages per (sort order, subspecialty, article type)
+combination, using a compact list-view projection without abstracts, plus a
+manifest describing every shard. The output directory can be synced to static
+storage or a CDN so feed pages load without touching the database.
+
+Each run writes a new versioned directory next to SNAPSHOT_DIR; SNAPSHOT_DIR
+itself is a symlink that is switched to the new version with one atomic rename.
+"""
+
+import json
+import os
+import re
+import shutil
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import db
+from rank_articles import parse_pub_date
+
+load_dotenv(Path(__file__).parent / ".env")
+
+SNAPSHOT_DIR = Path(os.environ.get("SNAPSHOT_DIR", Path(__file__).parent / "snapshots"))
+PAGE_SIZE = 50
+KEEP_VERSIONS = 2
+ALL = "all"
+
+# Everything the list view renders; the abstract is only loaded on the article page
+LIST_COLUMNS = (
+    "id", "title", "authors", "journal", "pub_date", "summary", "news_value",
+    "subspecialty", "article_type", "clinical_relevance", "citation_count",
+    "impact_factor", "is_open_access", "doi", "pub_types", "rank_score", "retraction_status",
+)
+
+# Sort orders offered by the feed: the options in article-list.tsx plus the composite rank
+SORT_KEYS = {
+    "rank": lambda a: (a["rank_score"] if a["rank_score"] is not None else float("-inf"), a["id"]),
+    "news_value": lambda a: (a["news_value"] or 0, a["id"]),
+    "date": lambda a: (a["_date"], a["id"]),
+    "citations": lambda a: (a["citation_count"] or 0, a["id"]),
+    "impact_factor": lambda a: (a["impact_factor"] or 0, a["id"]),
+}
+
+
+def slugify(value: str) -> str:
+    """Turn a facet value like "Skull base" into a path segment ("skull-base")."""
+    return re.sub(r"[^a-z0-9]+", "-", value.lower()).strip("-") or "unknown"
+
+
+def load_list_view() -> list[dict]:
+    """Stream the list-view projection of every article that is not a duplicate."""
+    articles = []
+    for a in db.stream_rows(
+        f"SELECT {', '.join(LIST_COLUMNS)} FROM articles WHERE duplicate_of IS NULL", chunk_size=2000
+    ):
+        if a["impact_factor"] is not None:
+            a["impact_factor"] = float(a["impact_factor"])
+        parsed = parse_pub_date(a["pub_date"])
+        a["_date"] = parsed.toordinal() if parsed else 0
+        articles.append(a)
+    return articles
+
+
+def build_shards(articles: list[dict]) -> dict[tuple[str, str, str], list[dict]]:
+    """Group articles into (sort, subspecialty, article_type) shards, already sorted."""
+    shards: dict[tuple[str, str, str], list[dict]] = defaultdict(list)
+    for sort, key in SORT_KEYS.items():
+        # Sort once per order; bucketing preserves that order inside every shard
+        for a in sorted(articles, key=key, reverse=True):
+            subs = (ALL, slugify(a["subspecialty"])) if a["subspecialty"] else (ALL,)
+            kinds = (ALL, slugify(a["article_type"])) if a["article_type"] else (ALL,)
+            for sub in subs:
+                for kind in kinds:
+                    shards[(sort, sub, kind)].append(a)
+    return shards
+
+
+def write_snapshot(shards: dict[tuple[str, str, str], list[dict]], out_dir: Path) -> dict:
+    """Write all shard pages plus manifest.json into out_dir; return the manifest."""
+    manifest = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "page_size": PAGE_SIZE,
+        "sorts": list(SORT_KEYS),
+        "shards": {},
+    }
+    for (sort, sub, kind), items in shards.items():
+        shard_dir = out_dir / sort / sub / kind
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        pages = max(1, -(-len(items) // PAGE_SIZE))
+        for page in range(pages):
+            chunk = items[page * PAGE_SIZE : (page + 1) * PAGE_SIZE]
+            payload = {
+                "page": page + 1,
+                "pages": pages,
+                "total": len(items),
+                "articles": [{c: a[c] for c in LIST_COLUMNS} for a in chunk],
+            }
+            with open(shard_dir / f"{page + 1}.json", "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        manifest["shards"][f"{sort}/{sub}/{kind}"] = {"total": len(items), "pages": pages}
+
+    with open(out_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def publish(out_dir: Path = SNAPSHOT_DIR) -> dict:
+    """Rebuild the snapshot in a new version directory and atomically repoint out_dir at it."""
+    articles = load_list_view()
+    shards = build_shards(articles)
+
+    versions = out_dir.with_name(out_dir.name + ".versions")
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    target = versions / version
+    target.mkdir(parents=True)
+    manifest = write_snapshot(shards, target)
+
+    if out_dir.exists() and not out_dir.is_symlink():
+        # Directory from before snapshots were versioned: move it aside once
+        out_dir.rename(versions / "legacy")
+    link = out_dir.with_name(out_dir.name + ".link")
+    if link.is_symlink():
+        link.unlink()
+    link.symlink_to(Path(versions.name) / version, target_is_directory=True)
+    os.replace(link, out_dir)
+
+    # Keep the previous version for readers that are still paging through it
+    by_age = sorted((p for p in versions.iterdir() if p.is_dir()), key=lambda p: p.stat().st_mtime)
+    for stale in by_age[:-KEEP_VERSIONS]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+    print(f"Published {len(manifest['shards'])} snapshot shards for {len(articles)} articles to {out_dir}.")
+    return manifest
+
+
+def main():
+    publish()
+    db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Compute a composite ranking score for every article and store it in an indexed column.
+
+The score blends news value, journal impact factor, citations and open access,
+multiplied by an exponential time decay on the publication date. It is computed
+for the whole corpus in one NumPy pass, and only scores that actually changed
+are written back.
+
+Scores are stored as log2(blend) + (published - epoch) / half-life. That orders
+articles exactly like blend * 0.5 ** (age / half-life), but the decay is anchored
+to a fixed epoch instead of today, so a score only changes when its inputs do.
+"""
+
+import json
+import os
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+import db
+
+load_dotenv(Path(__file__).parent / ".env")
+
+# Relative weight of each signal; every signal is scaled to 0..1 before weighting
+RANK_WEIGHTS = {
+    "news_value": 0.55,
+    "impact_factor": 0.2,
+    "citation_count": 0.15,
+    "is_open_access": 0.1,
+}
+RANK_WEIGHTS.update(json.loads(os.environ.get("RANK_WEIGHTS", "{}")))
+# Score halves every this many days after publication
+HALF_LIFE_DAYS = float(os.environ.get("RANK_HALF_LIFE_DAYS", "30"))
+# Values at or above these caps count as the maximum for their signal
+IMPACT_FACTOR_CAP = 20.0
+CITATION_CAP = 100.0
+# Scores are stored rounded, so unchanged inputs never cause a write
+SCORE_DECIMALS = 6
+DECAY_EPOCH = date(2000, 1, 1)
+# Floor for the blend so articles with no signal still get a finite score
+MIN_BLEND = 1e-6
+
+
+def parse_pub_date(pub_date: str) -> date | None:
+    """Parse a PubMed date like "2026 Feb 14", "2026 Feb" or "2026" into a date."""
+    if not pub_date:
+        return None
+    parts = pub_date.split()
+    for fmt, n in (("%Y %b %d", 3), ("%Y %b", 2), ("%Y", 1)):
+        try:
+            return datetime.strptime(" ".join(parts[:n]), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def ensure_rank_column(conn):
+    """Add the rank_score column and its index if they are missing (one-time, via init_schema)."""
+    cur = conn.cursor()
+    cur.execute("ALTER TABLE articles ADD COLUMN IF NOT EXISTS rank_score DOUBLE PRECISION")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS articles_rank_score_idx "
+        "ON articles (rank_score DESC NULLS LAST, id DESC)"
+    )
+    conn.commit()
+    cur.close()
+
+
+def compute_scores(
+    news_value: np.ndarray,
+    impact_factor: np.ndarray,
+    citation_count: np.ndarray,
+    is_open_access: np.ndarray,
+    epoch_days: np.ndarray,
+) -> np.ndarray:
+    """Vectorized composite score in log2 space; NaN impact factors count as zero."""
+    signals = {
+        "news_value": np.clip(news_value / 10.0, 0.0, 1.0),
+        "impact_factor": np.log1p(np.clip(np.nan_to_num(impact_factor), 0.0, IMPACT_FACTOR_CAP)) / np.log1p(IMPACT_FACTOR_CAP),
+        "citation_count": np.log1p(np.clip(citation_count, 0.0, CITATION_CAP)) / np.log1p(CITATION_CAP),
+        "is_open_access": (is_open_access > 0).astype(np.float64),
+    }
+    blend = sum(RANK_WEIGHTS[name] * values for name, values in signals.items())
+    return np.round(np.log2(np.maximum(blend, MIN_BLEND)) + epoch_days / HALF_LIFE_DAYS, SCORE_DECIMALS)
+
+
+def update_rank_scores(conn) -> int:
+    """Recompute every article's rank_score and write back the changed ones.
+
+    Expects the rank_score column from ensure_rank_column (run by init_schema).
+    """
+    ids, news, impact, cited, oa, epoch_days, stored = [], [], [], [], [], [], []
+    today = date.today()
+    for rows in db.stream_chunks(
+        "SELECT id, news_value, impact_factor, citation_count, is_open_access, "
+        "pub_date, fetched_at, rank_score FROM articles",
+        chunk_size=5000,
+    ):
+        for aid, nv, impact_factor, citations, open_access, pub_date, fetched_at, score in rows:
+            published = parse_pub_date(pub_date) or (fetched_at.date() if fetched_at else today)
+            # Future-dated issues count as published today
+            published = min(published, today)
+            ids.append(aid)
+            news.append(nv or 0)
+            impact.append(np.nan if impact_factor is None else float(impact_factor))
+            cited.append(citations or 0)
+            oa.append(open_access or 0)
+            epoch_days.append((published - DECAY_EPOCH).days)
+            stored.append(np.nan if score is None else score)
+
+    if not ids:
+        return 0
+
+    scores = compute_scores(
+        np.asarray(news, dtype=np.float64),
+        np.asarray(impact, dtype=np.float64),
+        np.asarray(cited, dtype=np.float64),
+        np.asarray(oa, dtype=np.float64),
+        np.asarray(epoch_days, dtype=np.float64),
+    )
+    stored_arr = np.asarray(stored, dtype=np.float64)
+    changed = np.flatnonzero(np.isnan(stored_arr) | (np.abs(scores - stored_arr) > 10 ** -SCORE_DECIMALS / 2))
+    if not len(changed):
+        return 0
+
+    ids_arr = np.asarray(ids, dtype=np.int64)
+    cur = conn.cursor()
+    execute_values(
+        cur,
+        "UPDATE articles AS a SET rank_score = v.score "
+        "FROM (VALUES %s) AS v(id, score) WHERE a.id = v.id",
+        [(int(ids_arr[i]), float(scores[i])) for i in changed],
+        page_size=1000,
+    )
+    conn.commit()
+    cur.close()
+    return len(changed)
+
+
+def main():
+    with db.connection() as conn:
+        changed = update_rank_scores(conn)
+    db.close_pool()
+    print(f"Updated rank_score for {changed} articles.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Re-fetch recent PubMed records and apply revisions made after first indexing.
+
+MeSH headings, full publication dates, DOIs and PMC IDs are often added to a
+record days or weeks after it first appears. This pass re-fetches recent
+articles whose fields still look incomplete, compares content hashes and
+updates only the columns that actually changed. Articles whose title or
+abstract changed are put back in the enrichment queue.
+"""
+
+from collections import defaultdict
+from pathlib import Path
+
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+import db
+from enrich_articles import RESET_ENRICHMENT_SQL
+from fetch_articles import HASHED_FIELDS, content_hash, fetch_articles
+
+load_dotenv(Path(__file__).parent / ".env")
+
+REVISION_WINDOW_DAYS = 90
+BATCH_SIZE = 100
+
+# Fields whose change invalidates the AI enrichment
+ENRICHMENT_FIELDS = {"title", "abstract"}
+
+CANDIDATES_SQL = f"""
+    SELECT url, pmid, content_hash, {", ".join(HASHED_FIELDS)} FROM articles
+    WHERE pmid != ''
+      AND fetched_at >= NOW() - make_interval(days => %s)
+      AND (
+        content_hash IS NULL
+        OR mesh_terms = '' OR doi = '' OR pmc_id = ''
+        OR pub_date !~ '^[0-9]{{4}} [A-Za-z]+ [0-9]+$'
+      )
+    ORDER BY id
+"""
+
+
+def diff_article(stored: dict, fresh: tuple) -> list[str]:
+    """Return the hashed fields whose fresh value differs from the stored one."""
+    return [
+        f for f, value in zip(HASHED_FIELDS, fresh)
+        if str(value) != str(stored[f] if stored[f] is not None else "")
+    ]
+
+
+def apply_revisions(conn, changes: dict[tuple[str, ...], list[tuple]]) -> None:
+    """Bulk-update each group of articles that share the same set of changed columns."""
+    cur = conn.cursor()
+    requeued_urls = []
+    for columns, rows in changes.items():
+        assignments = [f"{c} = v.{c}" for c in columns]
+        if ENRICHMENT_FIELDS & set(columns):
+            # Stale signature: recomputed by the next dedup load_index()
+            assignments += [RESET_ENRICHMENT_SQL, "minhash = NULL"]
+            requeued_urls.extend(r[0] for r in rows)
+        execute_values(
+            cur,
+            f"UPDATE articles AS a SET {', '.join(assignments)} "
+            f"FROM (VALUES %s) AS v(url, {', '.join(columns)}) "
+            f"WHERE a.url = v.url",
+            rows,
+        )
+    if requeued_urls:
+        # The revised text gets a fresh start, even if the old one was dead-lettered
+        cur.execute(
+            "DELETE FROM enrichment_failures f USING articles a "
+            "WHERE f.article_id = a.id AND a.url = ANY(%s)",
+            (requeued_urls,),
+        )
+    conn.commit()
+    cur.close()
+
+
+def main():
+    print(f"Checking articles fetched in the last {REVISION_WINDOW_DAYS} days for PubMed revisions...")
+
+    checked = 0
+    revised = 0
+    requeued = 0
+    column_counts: dict[str, int] = defaultdict(int)
+
+    with db.connection() as conn:
+
+        for rows in db.stream_chunks(CANDIDATES_SQL, (REVISION_WINDOW_DAYS,), chunk_size=BATCH_SIZE):
+            stored_by_pmid = {
+                r[1]: dict(zip(("url", "pmid", "content_hash") + HASHED_FIELDS, r))
+                for r in rows
+            }
+            try:
+                fresh_articles = fetch_articles(list(stored_by_pmid))
+            except Exception as e:
+                print(f"  Warning: PubMed batch failed: {e}")
+                continue
+            checked += len(stored_by_pmid)
+
+            # Group updates by the exact set of changed columns so each group is one statement
+            changes: dict[tuple[str, ...], list[tuple]] = defaultdict(list)
+            for pmid, fresh in zip(fresh_articles["pmid"], fresh_articles.rows(HASHED_FIELDS)):
+                stored = stored_by_pmid.get(pmid)
+                if stored is None:
+                    continue
+                new_hash = content_hash(fresh)
+                if new_hash == stored["content_hash"]:
+                    continue
+
+                changed = diff_article(stored, fresh)
+                fresh_values = dict(zip(HASHED_FIELDS, fresh))
+                columns = tuple(changed) + ("content_hash",)
+                values = [fresh_values[c] for c in changed] + [new_hash]
+                changes[columns].append((stored["url"], *values))
+
+                if changed:
+                    revised += 1
+                    for c in changed:
+                        column_counts[c] += 1
+                    if ENRICHMENT_FIELDS & set(changed):
+                        requeued += 1
+
+            if changes:
+                apply_revisions(conn, changes)
+
+    db.close_pool()
+
+    print(f"Checked {checked} articles, {revised} had revisions.")
+    for column, n in sorted(column_counts.items(), key=lambda x: -x[1]):
+        print(f"  {column}: {n}")
+    print(f"Re-queued {requeued} articles for enrichment (title or abstract changed).")
+
+
+if __name__ == "__main__":
+    main()
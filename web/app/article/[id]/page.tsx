@@ -1,4 +1,4 @@
-import { getArticle } from "@/lib/db";
+import { getArticle, getRelatedArticles } from "@/lib/db";
 import { notFound } from "next/navigation";
 import Link from "next/link";
 
@@ -52,7 +52,10 @@ export default async function ArticlePage({
   params: Promise<{ id: string }>;
 }) {
   const { id } = await params;
-  const article = await getArticle(Number(id));
+  const [article, related] = await Promise.all([
+    getArticle(Number(id)),
+    getRelatedArticles(Number(id)),
+  ]);
 
   if (!article) notFound();
 
@@ -83,6 +86,11 @@ export default async function ArticlePage({
               {article.title}
             </h1>
             <div className="mt-3 flex flex-wrap items-center gap-2">
+              {article.retraction_status && (
+                <span className="inline-flex rounded-md px-2.5 py-0.5 text-[11px] font-bold bg-red-600 text-white">
+                  {article.retraction_status === "retracted" ? "Retracted" : "Expression of Concern"}
+                </span>
+              )}
               {article.subspecialty && (
                 <span className={`inline-flex rounded-md px-2.5 py-0.5 text-[11px] font-semibold ring-1 ring-inset ${subStyle}`}>
                   {article.subspecialty}
@@ -220,6 +228,30 @@ export default async function ArticlePage({
             </div>
           )}
 
+          {/* Related articles */}
+          {related.length > 0 && (
+            <div className="border-t border-slate-100 dark:border-slate-700/60 p-6">
+              <h2 className="text-[11px] font-semibold uppercase tracking-wider text-slate-400 dark:text-slate-500 mb-3">
+                Related Articles
+              </h2>
+              <ul className="space-y-3">
+                {related.map(({ article: r }) => (
+                  <li key={r.id}>
+                    <Link
+                      href={`/article/${r.id}`}
+                      className="text-sm font-medium text-slate-700 hover:text-indigo-600 transition dark:text-slate-300 dark:hover:text-indigo-400"
+                    >
+                      {r.title}
+                    </Link>
+                    <p className="mt-0.5 text-[11px] text-slate-400 dark:text-slate-500">
+                      {[r.journal, r.pub_date, r.subspecialty].filter(Boolean).join(" · ")}
+                    </p>
+                  </li>
+                ))}
+              </ul>
+            </div>
+          )}
+
           {/* Footer */}
           <div className="border-t border-slate-100 dark:border-slate-700/60 px-6 py-3">
             <span className="text-[11px] text-slate-400 dark:text-slate-500">
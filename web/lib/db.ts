@@ -27,6 +27,9 @@ export interface Article {
   pmc_id: string;
   issn: string;
   impact_factor: number | null;
+  rank_score: number | null;
+  duplicate_of: number | null;
+  retraction_status: "retracted" | "expression_of_concern" | null;
   url: string;
   fetched_at: string;
 }
@@ -40,6 +43,7 @@ export async function getArticles(): Promise<Article[]> {
   const { data, error } = await supabase
     .from("articles")
     .select("*")
+    .is("duplicate_of", null)
     .order("news_value", { ascending: false })
     .order("id", { ascending: false });
 
@@ -67,3 +71,19 @@ export async function getArticle(id: number): Promise<Article | undefined> {
   if (error) return undefined;
   return data as Article;
 }
+
+export interface RelatedArticle {
+  score: number;
+  article: Pick<Article, "id" | "title" | "journal" | "pub_date" | "subspecialty">;
+}
+
+export async function getRelatedArticles(id: number): Promise<RelatedArticle[]> {
+  const { data, error } = await supabase
+    .from("related_articles")
+    .select("score, article:articles!related_id(id, title, journal, pub_date, subspecialty)")
+    .eq("article_id", id)
+    .order("rank");
+
+  if (error) return [];
+  return data as unknown as RelatedArticle[];
+}